@@ -0,0 +1,105 @@
+"""تسجيل آخر نشاط للمستخدمين بالكتابة المؤجلة (write-behind).
+
+إعادة تشغيل الصفحة لا تكتب في القاعدة: يُحفظ آخر نشاط لكل مستخدم في الذاكرة مقربًا إلى
+ACTIVITY_PRECISION ثانية، ثم تُكتب كل التغييرات في معاملة واحدة (executemany) كل
+FLUSH_INTERVAL ثانية أو عند تجمع MAX_PENDING مستخدمًا، وعند إغلاق العملية. هكذا يُحجز قفل
+الكتابة مرة كل دقيقة تقريبًا بدل مرة عند كل تفاعل، فلا تنتظر معاملات لوحة التحكم خلفه.
+"""
+import atexit
+import logging
+import threading
+import time
+
+import db
+import metrics
+
+ACTIVITY_PRECISION = 30 # ثوانٍ؛ النشاط داخل نفس الفترة لا يُعد تغييرًا
+FLUSH_INTERVAL = 60 # أقصى مدة (ثوانٍ) يبقى فيها النشاط في الذاكرة قبل كتابته
+MAX_PENDING = 500 # عدد المستخدمين المنتظرين الذي يستدعي الكتابة فورًا
+
+
+class ActivityTracker:
+    """تجميع أوقات النشاط لكل مستخدم في الذاكرة وكتابتها دفعة واحدة من خيط خلفي."""
+
+    def __init__(self, precision=ACTIVITY_PRECISION, interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.precision = precision
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {} # user_id -> آخر وقت نشاط لم يُكتب بعد
+        # user_id -> آخر وقت كُتب، لتجاهل النشاط المتكرر داخل نفس الفترة فقط؛ يُحذف منه
+        # بعد كل كتابة ما سبق الفترة الحالية حتى لا يبقى فيه كل مستخدم مر على العملية
+        self._written = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def record(self, user_id, timestamp=None):
+        """تسجيل نشاط المستخدم؛ لا يلمس القاعدة."""
+        if timestamp is None:
+            timestamp = time.time()
+        if self.precision:
+            timestamp -= timestamp % self.precision
+        with self._lock:
+            if self._written.get(user_id, -1) >= timestamp or self._pending.get(user_id, -1) >= timestamp:
+                return
+            self._pending[user_id] = timestamp
+            full = len(self._pending) >= self.max_pending
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="activity-flush", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """كتابة كل النشاط المنتظر في معاملة واحدة، وإعادة عدد المستخدمين المكتوبين."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                with metrics.timer("activity.flush"), db.connection() as conn:
+                    # MAX يمنع عملية أخرى كتبت وقتًا أحدث من أن يُستبدل بوقت أقدم
+                    conn.executemany(
+                        "UPDATE users SET last_activity_time = MAX(COALESCE(last_activity_time, 0), ?) WHERE user_id = ?",
+                        [(timestamp, user_id) for user_id, timestamp in batch.items()],
+                    )
+            except Exception:
+                # تُعاد الدفعة لتُكتب في المحاولة التالية دون أن تحل محل نشاط أحدث سُجل أثناءها
+                with self._lock:
+                    for user_id, timestamp in batch.items():
+                        if self._pending.get(user_id, -1) < timestamp:
+                            self._pending[user_id] = timestamp
+                raise
+            with self._lock:
+                self._written.update(batch)
+                self._prune_written()
+            return len(batch)
+
+    def _prune_written(self):
+        window_start = time.time()
+        if self.precision:
+            window_start -= window_start % self.precision
+        self._written = {user_id: timestamp for user_id, timestamp in self._written.items() if timestamp >= window_start}
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                metrics.log_event("activity_flush_failed", logging.WARNING, error=repr(e))
+
+
+tracker = ActivityTracker()
+atexit.register(tracker.flush)
+
+
+def record_activity(user_id):
+    tracker.record(user_id)
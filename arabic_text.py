@@ -0,0 +1,73 @@
+"""توحيد النص العربي للمطابقة، مع خريطة مواضع تعيد المطابقات إلى النص الأصلي المشكول."""
+from array import array
+from collections import namedtuple
+
+# الحركات وعلامات القرآن والتطويل تُحذف
+_REMOVED_CHARS = (
+    [chr(c) for c in range(0x0610, 0x061B)]
+    + [chr(c) for c in range(0x064B, 0x0660)]
+    + ["\u0670", "\u0640"] # الألف الخنجرية والتطويل
+    + [chr(c) for c in range(0x06D6, 0x06EE)]
+)
+# صور الألف والياء والتاء المربوطة تُوحد
+_REPLACED_CHARS = {
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+}
+_TABLE = {ord(c): None for c in _REMOVED_CHARS}
+_TABLE.update({ord(c): r for c, r in _REPLACED_CHARS.items()})
+
+# النص الموحد وخريطة مواضعه: offsets[i] هو موضع الحرف i من النص الموحد في النص الأصلي،
+# والعنصر الأخير طول النص الأصلي (لتحويل نهايات المطابقات). None إذا كانت المواضع متطابقة
+NormalizedText = namedtuple("NormalizedText", ["text", "offsets"])
+
+
+def normalize(text):
+    """توحيد نص (مثل الاستعلام) دون حفظ خريطة المواضع."""
+    return text.translate(_TABLE).lower()
+
+
+def normalize_with_offsets(text):
+    """توحيد نص المادة مع خريطة مواضع مضغوطة (array) إلى النص الأصلي."""
+    translated = text.translate(_TABLE)
+    if len(translated) == len(text):
+        lowered = translated.lower()
+        if len(lowered) == len(text):
+            # الحالة الشائعة: لا حذف ولا تغير في الطول، فالمواضع متطابقة ولا تُحفظ خريطة
+            return NormalizedText(lowered, None)
+
+    chars = []
+    offsets = array("I")
+    for i, ch in enumerate(text):
+        replacement = _TABLE.get(ord(ch), ch)
+        if replacement is None:
+            continue
+        for out in replacement.lower():
+            chars.append(out)
+            offsets.append(i)
+    offsets.append(len(text))
+    return NormalizedText("".join(chars), offsets)
+
+
+def to_original_spans(normalized, spans):
+    """تحويل مواضع (بداية، نهاية) في النص الموحد إلى مواضعها في النص الأصلي.
+
+    النهاية تمتد حتى الحرف الأصلي التالي، فتدخل حركات آخر حرف مطابق داخل التظليل.
+    """
+    offsets = normalized.offsets
+    if offsets is None:
+        return list(spans)
+    return [(offsets[s], offsets[e]) for s, e in spans]
+
+
+def _normalize_corpus(corpus):
+    if corpus.mapped is not None:
+        # النسخة المفتوحة من ملف المكتبة المشترك: عروض على النصوص الموحدة المخزنة فيه دون نسخ
+        return corpus.mapped.normalized_texts()
+    return [normalize_with_offsets("\n".join(article.paragraphs)) for _, article in corpus.entries()]
+
+
+def get_normalized_texts(corpus):
+    """النصوص الموحدة لجميع المواد (بترتيب corpus.entries())، تُحسب مرة واحدة لكل نسخة."""
+    return corpus.derived("normalized", _normalize_corpus)
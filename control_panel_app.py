@@ -1,182 +1,394 @@
 import streamlit as st
-import os
-import sqlite3
+import csv
+import io
 import uuid
 import time
 import pandas as pd
+import db
+import metrics
+from db_maintenance import REQUEST_RETENTION_DAYS, USER_RETENTION_DAYS, archive_stale_rows
 
-DATABASE_FILE = os.path.join(os.path.dirname(__file__), "user_data.db")
 TRIAL_DURATION = 300 # يجب أن تتطابق مع التطبيق الرئيسي
 
-def init_db():
-    """تهيئة قاعدة البيانات وإنشاء الجداول إذا لم تكن موجودة."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            is_activated INTEGER DEFAULT 0,
-            trial_start_time REAL,
-            last_activity_time REAL,
-            activation_code_used TEXT
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS activation_codes (
-            code TEXT PRIMARY KEY,
-            is_used INTEGER DEFAULT 0,
-            used_by_user_id TEXT,
-            FOREIGN KEY (used_by_user_id) REFERENCES users(user_id)
-        )
-    ''')
-    # جدول طلبات التفعيل الجديدة (يجب أن يكون مطابقاً لـ main.py)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS activation_requests (
-            request_id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            activation_code TEXT,
-            request_time REAL NOT NULL,
-            status TEXT DEFAULT 'pending', -- 'pending', 'approved', 'rejected'
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (activation_code) REFERENCES activation_codes(code)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+MAX_BULK_CODES = 100_000 # أقصى عدد أكواد في عملية توليد واحدة
+CODES_SHOWN_INLINE = 20 # أكثر من ذلك تُعرض عينة منها ويُنزل الباقي كملف CSV
+INSERT_BATCH_SIZE = 10_000 # صفوف كل استدعاء executemany
+
+def _new_code():
+    return str(uuid.uuid4()).replace('-', '')[:10].upper()
+
+def _batches(items, size=INSERT_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 def generate_activation_codes(num_codes):
-    """توليد أكواد تفعيل فريدة وإضافتها إلى قاعدة البيانات."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
+    """توليد num_codes كود تفعيل فريد بالضبط وإضافتها إلى قاعدة البيانات في معاملة واحدة.
+
+    الأكواد المرشحة تُكتب في جدول مؤقت ويُحذف منها ما يوجد في activation_codes، ثم يُعاد
+    توليد بدل ما حُذف حتى يكتمل العدد. المعاملة تحجز قفل الكتابة من بدايتها فلا يضيف
+    أحد الكود نفسه أثناءها.
+    """
     generated_codes = []
-    for _ in range(num_codes):
-        code = str(uuid.uuid4()).replace('-', '')[:10].upper() # توليد كود فريد
+    with db.transaction() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_codes (code TEXT PRIMARY KEY)")
         try:
-            c.execute("INSERT INTO activation_codes (code, is_used) VALUES (?, 0)", (code,))
-            generated_codes.append(code)
-        except sqlite3.IntegrityError:
-            # في حال تكرار الكود (نادراً جداً)، جرب كوداً آخر
-            pass
-    conn.commit()
-    conn.close()
+            while len(generated_codes) < num_codes:
+                conn.execute("DELETE FROM new_codes")
+                candidates = {_new_code() for _ in range(num_codes - len(generated_codes))}
+                for batch in _batches(list(candidates)):
+                    conn.executemany("INSERT INTO new_codes (code) VALUES (?)", [(code,) for code in batch])
+                conn.execute("DELETE FROM new_codes WHERE code IN (SELECT code FROM activation_codes)")
+                conn.execute("INSERT INTO activation_codes (code, is_used) SELECT code, 0 FROM new_codes")
+                generated_codes += [row[0] for row in conn.execute("SELECT code FROM new_codes")]
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.new_codes")
     return generated_codes
 
-def get_all_activation_codes():
-    """الحصول على جميع أكواد التفعيل وحالتها."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT code, is_used, used_by_user_id FROM activation_codes")
-    codes = c.fetchall()
-    conn.close()
-    return codes
-
-def get_all_users():
-    """الحصول على جميع المستخدمين وحالاتهم."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT user_id, is_activated, trial_start_time, last_activity_time, activation_code_used FROM users")
-    users = c.fetchall()
-    conn.close()
-    return users
+def parse_codes(text):
+    """أكواد من نص (لصق أو ملف CSV/نصي): أول عمود في كل سطر، دون الفراغات والتكرار وسطر العنوان."""
+    codes = []
+    for line in text.splitlines():
+        code = line.split(",")[0].strip().strip('"').strip()
+        if code and code.lower() not in ("code", "كود التفعيل"):
+            codes.append(code)
+    return list(dict.fromkeys(codes))
+
+def import_activation_codes(codes):
+    """إضافة أكواد جاهزة في معاملة واحدة؛ يعيد (عدد المضاف، عدد الموجود مسبقًا)."""
+    inserted = 0
+    with db.transaction() as conn:
+        for batch in _batches(codes):
+            inserted += conn.executemany("INSERT OR IGNORE INTO activation_codes (code, is_used) VALUES (?, 0)",
+                                         [(code,) for code in batch]).rowcount
+    return inserted, len(codes) - inserted
+
+def revoke_activation_codes(codes):
+    """حذف الأكواد غير المستخدمة من القائمة في معاملة واحدة؛ يعيد (عدد الملغى، عدد المتروك).
+
+    الأكواد المستخدمة أو المرتبطة بطلب تفعيل (is_used = 1) لا تُحذف حتى لا ينفصل عنها مستخدموها.
+    """
+    revoked = 0
+    with db.transaction() as conn:
+        for batch in _batches(codes):
+            revoked += conn.executemany("DELETE FROM activation_codes WHERE code = ? AND is_used = 0",
+                                        [(code,) for code in batch]).rowcount
+    return revoked, len(codes) - revoked
+
+def codes_to_csv(codes):
+    """ملف CSV بعمود واحد للأكواد (utf-8-sig ليفتحه Excel مباشرة)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["code"])
+    writer.writerows([code] for code in codes)
+    return buffer.getvalue().encode("utf-8-sig")
+
+def read_codes_input(key):
+    """الأكواد من ملف مرفوع أو من نص ملصوق."""
+    uploaded = st.file_uploader("ملف أكواد (CSV أو نص، كود في كل سطر)", type=["csv", "txt"], key=f"{key}_file")
+    pasted = st.text_area("أو الصق الأكواد هنا (كود في كل سطر)", key=f"{key}_text")
+    text = uploaded.getvalue().decode("utf-8-sig") if uploaded is not None else pasted
+    return parse_codes(text)
+
+PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+
+CODE_FILTERS = ["الكل", "مستخدم", "غير مستخدم"]
+USER_FILTERS = ["الكل", "مفعل", "تجربة نشطة", "تجربة منتهية", "لم يبدأ التجربة"]
+# عناوين الترتيب -> أعمدة مفهرسة (لا تُبنى عبارة ORDER BY من مدخلات المستخدم مباشرة)
+CODE_SORTS = {"كود التفعيل": "code", "معرف المستخدم": "used_by_user_id"}
+USER_SORTS = {"آخر نشاط": "last_activity_time", "وقت بدء التجربة": "trial_start_time", "معرف المستخدم": "user_id"}
+
+def _prefix_condition(column, prefix):
+    """شرط بداية النص كنطاق على العمود حتى يستخدم فهرسه (LIKE لا يستخدمه مع مقارنة حساسة لحالة الأحرف)."""
+    return f"{column} >= ? AND {column} < ?", [prefix, prefix + "\U0010ffff"]
+
+def _where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+def count_rows(table, conditions, params):
+    """عدد صفوف الجدول المطابقة للشروط."""
+    return db.query_one(f"SELECT COUNT(*) FROM {table} {_where(conditions)}", params)[0]
+
+def fetch_page(table, columns, conditions, params, order_column, descending, limit, offset):
+    """صفحة من الجدول بعد الفلترة والترتيب في SQL (LIMIT/OFFSET) بدل جلب كل الصفوف."""
+    direction = "DESC" if descending else "ASC"
+    # عمود المفتاح يثبت ترتيب الصفوف المتساوية فلا تتكرر صفوف بين الصفحات
+    return db.query_all(
+        f"SELECT {', '.join(columns)} FROM {table} {_where(conditions)} "
+        f"ORDER BY {order_column} {direction}, {columns[0]} {direction} LIMIT ? OFFSET ?",
+        params + [limit, offset],
+    )
+
+def activation_codes_filter(status="الكل", prefix=""):
+    """شروط SQL ومعاملاتها لفلترة أكواد التفعيل بالحالة وبداية الكود."""
+    conditions, params = [], []
+    if status == "مستخدم":
+        conditions.append("is_used = 1")
+    elif status == "غير مستخدم":
+        conditions.append("is_used = 0")
+    if prefix:
+        condition, values = _prefix_condition("code", prefix)
+        conditions.append(condition)
+        params += values
+    return conditions, params
+
+def users_filter(status="الكل", prefix=""):
+    """شروط SQL ومعاملاتها لفلترة المستخدمين بحالة التفعيل والتجربة وبداية المعرف."""
+    conditions, params = [], []
+    if status == "مفعل":
+        conditions.append("is_activated = 1")
+    elif status == "تجربة نشطة":
+        conditions += ["is_activated = 0", "trial_start_time >= ?"]
+        params.append(time.time() - TRIAL_DURATION)
+    elif status == "تجربة منتهية":
+        conditions += ["is_activated = 0", "trial_start_time < ?"]
+        params.append(time.time() - TRIAL_DURATION)
+    elif status == "لم يبدأ التجربة":
+        conditions += ["is_activated = 0", "trial_start_time IS NULL"]
+    if prefix:
+        condition, values = _prefix_condition("user_id", prefix)
+        conditions.append(condition)
+        params += values
+    return conditions, params
+
+def _format_times(df, columns):
+    """تحويل أعمدة الثواني إلى تواريخ دفعة واحدة لكل عمود (القيم الفارغة تبقى فارغة)."""
+    for column in columns:
+        df[column] = pd.to_datetime(df[column], unit='s')
+
+def _yes_no(series):
+    return series.map({1: "نعم"}).fillna("لا")
+
+def render_page_controls(key, total):
+    """اختيار حجم الصفحة ورقمها؛ يعيد (limit، offset)."""
+    col1, col2 = st.columns(2)
+    with col1:
+        page_size = st.selectbox("عدد الصفوف في الصفحة", PAGE_SIZE_OPTIONS, index=1, key=f"{key}_page_size")
+    page_count = max(1, -(-total // page_size))
+    with col2:
+        page = st.number_input(f"الصفحة (من {page_count})", min_value=1, max_value=page_count, value=1, key=f"{key}_page")
+    return page_size, (page - 1) * page_size
+
+def render_table_filters(key, filters, sorts, prefix_label, descending):
+    """عناصر الفلترة والترتيب لجدول؛ يعيد (الحالة، البادئة، الترتيب، تنازلي)."""
+    col1, col2 = st.columns(2)
+    with col1:
+        status = st.selectbox("الحالة", filters, key=f"{key}_status")
+        sort = st.selectbox("الترتيب حسب", list(sorts), key=f"{key}_sort")
+    with col2:
+        prefix = st.text_input(prefix_label, key=f"{key}_prefix").strip()
+        descending = st.checkbox("ترتيب تنازلي", value=descending, key=f"{key}_descending")
+    return status, prefix, sort, descending
+
+def render_codes_table(key):
+    """جدول أكواد التفعيل مع الفلترة والترتيب والتصفح؛ يعيد False إذا لم يطابق أي كود."""
+    status, prefix, sort, descending = render_table_filters(key, CODE_FILTERS, CODE_SORTS, "بحث ببداية الكود", False)
+    conditions, params = activation_codes_filter(status, prefix)
+    total = count_rows("activation_codes", conditions, params)
+    limit, offset = render_page_controls(key, total)
+    rows = fetch_page("activation_codes", ["code", "is_used", "used_by_user_id"], conditions, params,
+                      CODE_SORTS[sort], descending, limit, offset)
+    if not rows:
+        return False
+    df_codes = pd.DataFrame(rows, columns=["كود التفعيل", "مستخدم", "معرف المستخدم الذي استخدمه"])
+    df_codes["مستخدم"] = _yes_no(df_codes["مستخدم"])
+    st.caption(f"{total} كود مطابق")
+    st.dataframe(df_codes, height=300)
+    return True
+
+def render_users_table(key):
+    """جدول المستخدمين مع الفلترة والترتيب والتصفح؛ يعيد False إذا لم يطابق أي مستخدم."""
+    status, prefix, sort, descending = render_table_filters(key, USER_FILTERS, USER_SORTS, "بحث ببداية معرف المستخدم", True)
+    conditions, params = users_filter(status, prefix)
+    total = count_rows("users", conditions, params)
+    limit, offset = render_page_controls(key, total)
+    rows = fetch_page("users", ["user_id", "is_activated", "trial_start_time", "last_activity_time", "activation_code_used"],
+                      conditions, params, USER_SORTS[sort], descending, limit, offset)
+    if not rows:
+        return False
+    df_users = pd.DataFrame(rows, columns=["معرف المستخدم", "مفعل", "وقت بدء التجربة", "آخر نشاط", "الكود المستخدم"])
+    df_users["مفعل"] = _yes_no(df_users["مفعل"])
+    # التحويل على صفوف الصفحة المعروضة فقط
+    _format_times(df_users, ["وقت بدء التجربة", "آخر نشاط"])
+    st.caption(f"{total} مستخدم مطابق")
+    st.dataframe(df_users, height=300)
+    return True
 
 def delete_activation_code(code):
     """حذف كود تفعيل من قاعدة البيانات."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM activation_codes WHERE code = ?", (code,))
-    conn.commit()
-    conn.close()
+    db.execute("DELETE FROM activation_codes WHERE code = ?", (code,))
 
 def reset_user_activation(user_id):
     """إعادة تعيين حالة التفعيل لمستخدم معين."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("UPDATE users SET is_activated = 0, trial_start_time = NULL, activation_code_used = NULL WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    db.execute("UPDATE users SET is_activated = 0, trial_start_time = NULL, activation_code_used = NULL WHERE user_id = ?", (user_id,))
 
 # --- بداية الدوال الجديدة لإدارة الطلبات ---
-def get_pending_activation_requests():
-    """الحصول على جميع طلبات التفعيل المعلقة."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT request_id, user_id, activation_code, request_time FROM activation_requests WHERE status = 'pending'")
-    requests = c.fetchall()
-    conn.close()
-    return requests
-
-def approve_activation_request(request_id, user_id, activation_code):
-    """الموافقة على طلب تفعيل."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    try:
-        # 1. تفعيل المستخدم
-        c.execute("UPDATE users SET is_activated = 1, activation_code_used = ? WHERE user_id = ?", (activation_code, user_id))
-        # 2. تحديث حالة الكود (يجب أن يكون قد تم تعيينه إلى is_used=1 عند الإرسال)
-        # هنا نتأكد فقط من ربط المستخدم بالكود بشكل نهائي.
-        c.execute("UPDATE activation_codes SET is_used = 1, used_by_user_id = ? WHERE code = ?", (user_id, activation_code))
-        # 3. تحديث حالة الطلب
-        c.execute("UPDATE activation_requests SET status = 'approved' WHERE request_id = ?", (request_id,))
-        conn.commit()
-        return True
-    except Exception as e:
-        st.error(f"حدث خطأ أثناء الموافقة: {e}")
-        conn.rollback()
-        return False
-    finally:
-        conn.close()
+REQUEST_COLUMNS = ["request_id", "user_id", "activation_code", "request_time"]
+
+def pending_requests_filter(user_prefix="", code_prefix=""):
+    """شروط SQL ومعاملاتها للطلبات المعلقة مع فلترة ببداية معرف المستخدم أو الكود."""
+    conditions, params = ["status = 'pending'"], []
+    for column, prefix in (("user_id", user_prefix), ("activation_code", code_prefix)):
+        if prefix:
+            condition, values = _prefix_condition(column, prefix)
+            conditions.append(condition)
+            params += values
+    return conditions, params
+
+def _select_batch(conn, request_ids=None, conditions=None, params=()):
+    """ملء الجدول المؤقت batch_requests بالطلبات المعلقة المقصودة (بأرقامها أو بشروط فلترة)."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_requests (request_id TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM batch_requests")
+    if request_ids is not None:
+        conn.executemany("INSERT OR IGNORE INTO batch_requests (request_id) VALUES (?)", [(i,) for i in request_ids])
+        # طلب حُسم في جلسة أخرى بعد عرض الصفحة لا يُحسم مرة ثانية
+        conn.execute("DELETE FROM batch_requests WHERE request_id NOT IN "
+                     "(SELECT request_id FROM activation_requests WHERE status = 'pending')")
+    else:
+        conn.execute(f"INSERT INTO batch_requests SELECT request_id FROM activation_requests {_where(conditions)}", list(params))
+    return conn.execute("SELECT COUNT(*) FROM batch_requests").fetchone()[0]
+
+# طلبات الدفعة الحالية بكل أعمدتها
+_BATCH_ROWS = "SELECT r.* FROM activation_requests r JOIN batch_requests b ON b.request_id = r.request_id"
+
+def approve_activation_requests(request_ids=None, conditions=None, params=()):
+    """الموافقة على عدة طلبات معلقة في معاملة واحدة بعبارات على المجموعة كلها؛ يعيد عدد الطلبات.
+
+    الطلبات تُحدد بأرقامها (request_ids) أو بشروط فلترة (pending_requests_filter).
+    """
+    with db.transaction() as conn:
+        try:
+            count = _select_batch(conn, request_ids, conditions, params)
+            # 1. تفعيل المستخدمين وربط كل مستخدم بكود أحدث طلباته في الدفعة
+            conn.execute(f'''
+                UPDATE users SET is_activated = 1, activation_code_used = (
+                    SELECT r.activation_code FROM ({_BATCH_ROWS}) r
+                    WHERE r.user_id = users.user_id ORDER BY r.request_time DESC LIMIT 1)
+                WHERE user_id IN (SELECT user_id FROM ({_BATCH_ROWS}))
+            ''')
+            # 2. ربط الأكواد بمستخدميها نهائيًا (عُلّمت مستخدمة عند إرسال الطلب)
+            conn.execute(f'''
+                UPDATE activation_codes SET is_used = 1, used_by_user_id = (
+                    SELECT r.user_id FROM ({_BATCH_ROWS}) r
+                    WHERE r.activation_code = activation_codes.code ORDER BY r.request_time DESC LIMIT 1)
+                WHERE code IN (SELECT activation_code FROM ({_BATCH_ROWS}))
+            ''')
+            # 3. تحديث حالة الطلبات
+            conn.execute("UPDATE activation_requests SET status = 'approved' WHERE request_id IN (SELECT request_id FROM batch_requests)")
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.batch_requests")
+    return count
+
+def reject_activation_requests(request_ids=None, conditions=None, params=()):
+    """رفض عدة طلبات معلقة في معاملة واحدة وإتاحة أكوادها من جديد؛ يعيد عدد الطلبات."""
+    with db.transaction() as conn:
+        try:
+            count = _select_batch(conn, request_ids, conditions, params)
+            # 1. تحديث حالة الأكواد لتصبح متاحة مرة أخرى
+            conn.execute(f"UPDATE activation_codes SET is_used = 0, used_by_user_id = NULL "
+                         f"WHERE code IN (SELECT activation_code FROM ({_BATCH_ROWS}))")
+            # 2. تحديث حالة الطلبات
+            conn.execute("UPDATE activation_requests SET status = 'rejected' WHERE request_id IN (SELECT request_id FROM batch_requests)")
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.batch_requests")
+    return count
 
-def reject_activation_request(request_id, activation_code):
-    """رفض طلب تفعيل."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
+def resolve_requests(approve, **selection):
+    """تنفيذ الموافقة أو الرفض وحفظ رسالة النتيجة للعرض بعد إعادة التشغيل؛ يعيد True عند النجاح."""
     try:
-        # 1. تحديث حالة الكود ليصبح متاحاً مرة أخرى
-        c.execute("UPDATE activation_codes SET is_used = 0, used_by_user_id = NULL WHERE code = ?", (activation_code,))
-        # 2. تحديث حالة الطلب
-        c.execute("UPDATE activation_requests SET status = 'rejected' WHERE request_id = ?", (request_id,))
-        conn.commit()
-        return True
+        count = (approve_activation_requests if approve else reject_activation_requests)(**selection)
     except Exception as e:
-        st.error(f"حدث خطأ أثناء الرفض: {e}")
-        conn.rollback()
+        st.error(f"حدث خطأ أثناء {'الموافقة' if approve else 'الرفض'}: {e}")
         return False
-    finally:
-        conn.close()
+    st.session_state.requests_message = f"تمت الموافقة على {count} طلب." if approve else f"تم رفض {count} طلب."
+    return True
 # --- نهاية الدوال الجديدة لإدارة الطلبات ---
 
+def render_metrics():
+    """مئينات أزمنة المراحل والعدادات ونسب إصابة الذاكرات المؤقتة، مدمجة من لقطات كل العمليات."""
+    metrics.write_snapshot() # لقطة هذه العملية محدثة قبل القراءة
+    merged = metrics.merge_snapshots(metrics.load_snapshots())
+    st.caption(f"مدمجة من {merged['processes']} عملية (تُحدَّث لقطة كل عملية كل {metrics.SNAPSHOT_INTERVAL} ثانية).")
+
+    st.subheader("أزمنة المراحل (م.ث)")
+    rows = metrics.summarize(merged)
+    if rows:
+        df_timers = pd.DataFrame(rows, columns=["المرحلة", "العدد", "المتوسط", "p50", "p95", "p99", "الأكبر"])
+        ms_columns = ["المتوسط", "p50", "p95", "p99", "الأكبر"]
+        df_timers[ms_columns] = (df_timers[ms_columns] * 1000).round(2)
+        st.dataframe(df_timers, hide_index=True)
+    else:
+        st.info("لا توجد قياسات بعد.")
+
+    st.subheader("الذاكرات المؤقتة")
+    if merged["caches"]:
+        df_caches = pd.DataFrame(
+            [(name, stats.get("hits", 0), stats.get("misses", 0), metrics.cache_hit_rate(stats), stats.get("entries", 0))
+             for name, stats in sorted(merged["caches"].items())],
+            columns=["الذاكرة", "إصابات", "إخفاقات", "نسبة الإصابة", "العناصر"],
+        )
+        df_caches["نسبة الإصابة"] = (df_caches["نسبة الإصابة"] * 100).round(1)
+        st.dataframe(df_caches, hide_index=True)
+
+    if merged["counters"]:
+        st.subheader("العدادات")
+        st.dataframe(pd.DataFrame(sorted(merged["counters"].items()), columns=["العداد", "القيمة"]), hide_index=True)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("⬇️ تصدير JSON", metrics.to_json(merged).encode("utf-8"), file_name="metrics.json", mime="application/json")
+    with col2:
+        st.download_button("⬇️ تصدير Prometheus", metrics.to_prometheus(merged).encode("utf-8"), file_name="metrics.prom", mime="text/plain")
+
 st.set_page_config(page_title="لوحة تحكم القوانين اليمنية", layout="centered")
 st.markdown("<h1 style='text-align: center;'>لوحة تحكم تطبيق القوانين اليمنية</h1>", unsafe_allow_html=True)
 # تم تحديث st.experimental_rerun() إلى st.rerun()
 st.button("🔄 تحديث البيانات", on_click=lambda: st.rerun())
 
-# تهيئة قاعدة البيانات عند بدء تشغيل لوحة التحكم
-init_db()
-
-menu_options = ["توليد أكواد التفعيل", "عرض الأكواد والمستخدمين", "إدارة المستخدمين", "إدارة طلبات التفعيل"]
+menu_options = ["توليد أكواد التفعيل", "استيراد وإلغاء الأكواد", "عرض الأكواد والمستخدمين", "إدارة المستخدمين", "إدارة طلبات التفعيل", "صيانة القاعدة", "مقاييس الأداء"]
 selected_option = st.sidebar.selectbox("اختر خيارًا:", menu_options)
 
 if selected_option == "توليد أكواد التفعيل":
     st.header("توليد أكواد تفعيل جديدة")
-    num_to_generate = st.number_input("عدد الأكواد لتوليدها:", min_value=1, max_value=100, value=1)
+    num_to_generate = st.number_input("عدد الأكواد لتوليدها:", min_value=1, max_value=MAX_BULK_CODES, value=1)
     if st.button("توليد وحفظ الأكواد"):
-        new_codes = generate_activation_codes(num_to_generate)
-        if new_codes:
-            st.success(f"تم توليد {len(new_codes)} كود تفعيل جديد:")
-            for code in new_codes:
-                st.code(code)
-            st.info("الرجاء نسخ هذه الأكواد وتوزيعها بعناية.")
+        # تُحفظ في الجلسة حتى يبقى زر التنزيل متاحًا بعد إعادة تشغيل الصفحة
+        st.session_state.generated_codes = generate_activation_codes(num_to_generate)
+    new_codes = st.session_state.get("generated_codes")
+    if new_codes:
+        st.success(f"تم توليد {len(new_codes)} كود تفعيل جديد:")
+        for code in new_codes[:CODES_SHOWN_INLINE]:
+            st.code(code)
+        if len(new_codes) > CODES_SHOWN_INLINE:
+            st.caption(f"عُرض أول {CODES_SHOWN_INLINE} كود فقط؛ نزّل الملف للحصول على الدفعة كاملة.")
+        st.download_button("⬇️ تنزيل الأكواد (CSV)", codes_to_csv(new_codes), file_name="activation_codes.csv", mime="text/csv")
+        st.info("الرجاء نسخ هذه الأكواد وتوزيعها بعناية.")
+    elif new_codes is not None:
+        st.warning("لم يتم توليد أي أكواد جديدة.")
+
+elif selected_option == "استيراد وإلغاء الأكواد":
+    st.header("استيراد أكواد تفعيل")
+    codes_to_import = read_codes_input("import")
+    if st.button("استيراد الأكواد"):
+        if codes_to_import:
+            inserted, skipped = import_activation_codes(codes_to_import)
+            st.success(f"تمت إضافة {inserted} كود، وتُرك {skipped} كود موجود مسبقًا.")
+        else:
+            st.warning("الرجاء رفع ملف أو لصق أكواد لاستيرادها.")
+
+    st.header("إلغاء أكواد تفعيل")
+    codes_to_revoke = read_codes_input("revoke")
+    if st.button("إلغاء الأكواد"):
+        if codes_to_revoke:
+            revoked, skipped = revoke_activation_codes(codes_to_revoke)
+            st.success(f"تم إلغاء {revoked} كود.")
+            if skipped:
+                st.warning(f"لم يُلغَ {skipped} كود لأنه مستخدم أو مرتبط بطلب تفعيل أو غير موجود.")
         else:
-            st.warning("لم يتم توليد أي أكواد جديدة.")
+            st.warning("الرجاء رفع ملف أو لصق أكواد لإلغائها.")
 
 elif selected_option == "عرض الأكواد والمستخدمين":
     st.header("عرض أكواد التفعيل")
-    codes_data = get_all_activation_codes()
-    if codes_data:
-        df_codes = pd.DataFrame(codes_data, columns=["كود التفعيل", "مستخدم", "معرف المستخدم الذي استخدمه"])
-        df_codes["مستخدم"] = df_codes["مستخدم"].apply(lambda x: "نعم" if x == 1 else "لا")
-        st.dataframe(df_codes, height=300)
-
+    if render_codes_table("codes"):
         st.subheader("حذف كود تفعيل")
         code_to_delete = st.text_input("أدخل الكود الذي تريد حذفه:")
         if st.button("حذف الكود"):
@@ -187,31 +399,15 @@ elif selected_option == "عرض الأكواد والمستخدمين":
             else:
                 st.warning("الرجاء إدخال كود لحذفه.")
     else:
-        st.info("لا توجد أكواد تفعيل حاليًا.")
+        st.info("لا توجد أكواد تفعيل مطابقة حاليًا.")
 
     st.header("عرض المستخدمين")
-    users_data = get_all_users()
-    if users_data:
-        df_users = pd.DataFrame(users_data, columns=["معرف المستخدم", "مفعل", "وقت بدء التجربة", "آخر نشاط", "الكود المستخدم"])
-        df_users["مفعل"] = df_users["مفعل"].apply(lambda x: "نعم" if x == 1 else "لا")
-        df_users["وقت بدء التجربة"] = df_users["وقت بدء التجربة"].apply(lambda x: pd.to_datetime(x, unit='s') if x else "N/A")
-        df_users["آخر نشاط"] = df_users["آخر نشاط"].apply(lambda x: pd.to_datetime(x, unit='s') if x else "N/A")
-
-        st.dataframe(df_users, height=300)
-    else:
-        st.info("لا يوجد مستخدمون مسجلون حاليًا.")
+    if not render_users_table("view_users"):
+        st.info("لا يوجد مستخدمون مطابقون حاليًا.")
 
 elif selected_option == "إدارة المستخدمين":
     st.header("إدارة المستخدمين")
-    users_data = get_all_users()
-    if users_data:
-        df_users = pd.DataFrame(users_data, columns=["معرف المستخدم", "مفعل", "وقت بدء التجربة", "آخر نشاط", "الكود المستخدم"])
-        df_users["مفعل"] = df_users["مفعل"].apply(lambda x: "نعم" if x == 1 else "لا")
-        df_users["وقت بدء التجربة"] = df_users["وقت بدء التجربة"].apply(lambda x: pd.to_datetime(x, unit='s') if x else "N/A")
-        df_users["آخر نشاط"] = df_users["آخر نشاط"].apply(lambda x: pd.to_datetime(x, unit='s') if x else "N/A")
-        
-        st.dataframe(df_users, height=300)
-
+    if render_users_table("manage_users"):
         st.subheader("إعادة تعيين تفعيل مستخدم")
         user_id_to_reset = st.text_input("أدخل معرف المستخدم لإعادة تعيين التفعيل:")
         if st.button("إعادة تعيين التفعيل"):
@@ -222,40 +418,63 @@ elif selected_option == "إدارة المستخدمين":
             else:
                 st.warning("الرجاء إدخال معرف المستخدم.")
     else:
-        st.info("لا يوجد مستخدمون حاليًا لإدارتهم.")
+        st.info("لا يوجد مستخدمون مطابقون حاليًا لإدارتهم.")
 
 # --- قسم جديد لإدارة طلبات التفعيل ---
 elif selected_option == "إدارة طلبات التفعيل":
     st.header("طلبات التفعيل المعلقة")
-    pending_requests = get_pending_activation_requests()
+    if "requests_message" in st.session_state:
+        st.success(st.session_state.pop("requests_message"))
+
+    col1, col2 = st.columns(2)
+    with col1:
+        user_prefix = st.text_input("بحث ببداية معرف المستخدم", key="requests_user_prefix").strip()
+    with col2:
+        code_prefix = st.text_input("بحث ببداية الكود", key="requests_code_prefix").strip()
+    conditions, params = pending_requests_filter(user_prefix, code_prefix)
+    total = count_rows("activation_requests", conditions, params)
 
-    if pending_requests:
+    if total:
+        limit, offset = render_page_controls("requests", total)
+        pending_requests = fetch_page("activation_requests", REQUEST_COLUMNS, conditions, params, "request_time", False, limit, offset)
         df_requests = pd.DataFrame(pending_requests, columns=["معرف الطلب", "معرف المستخدم", "كود التفعيل", "وقت الطلب"])
-        df_requests["وقت الطلب"] = df_requests["وقت الطلب"].apply(lambda x: pd.to_datetime(x, unit='s'))
-        st.dataframe(df_requests, height=300)
+        df_requests["وقت الطلب"] = pd.to_datetime(df_requests["وقت الطلب"], unit='s')
+        st.caption(f"{total} طلب معلق مطابق. حدد صفوفًا من الجدول للموافقة عليها أو رفضها معًا.")
+        selection = st.dataframe(df_requests, height=300, on_select="rerun", selection_mode="multi-row", key="requests_table")
+        selected_ids = [pending_requests[i][0] for i in selection.selection.rows if i < len(pending_requests)]
 
         st.subheader("إدارة الطلبات")
-        for req in pending_requests:
-            request_id, user_id, activation_code, request_time = req
-            col1, col2, col3 = st.columns([2, 1, 1])
-            with col1:
-                st.write(f"**المستخدم:** `{user_id}`")
-                st.write(f"**الكود:** `{activation_code}`")
-                st.write(f"**وقت الطلب:** `{pd.to_datetime(request_time, unit='s')}`")
-            with col2:
-                if st.button(f"✅ موافقة (ID: {request_id[:4]}...)", key=f"approve_{request_id}"):
-                    if approve_activation_request(request_id, user_id, activation_code):
-                        st.success(f"تمت الموافقة على طلب المستخدم {user_id[:8]}...")
-                        st.rerun()
-                    else:
-                        st.error("فشل الموافقة.")
-            with col3:
-                if st.button(f"❌ رفض (ID: {request_id[:4]}...)", key=f"reject_{request_id}"):
-                    if reject_activation_request(request_id, activation_code):
-                        st.warning(f"تم رفض طلب المستخدم {user_id[:8]}...")
-                        st.rerun()
-                    else:
-                        st.error("فشل الرفض.")
-            st.markdown("---") # خط فاصل بين الطلبات
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button(f"✅ موافقة على المحدد ({len(selected_ids)})", disabled=not selected_ids):
+                if resolve_requests(True, request_ids=selected_ids):
+                    st.rerun()
+            if st.button(f"✅ موافقة على كل المطابق ({total})"):
+                if resolve_requests(True, conditions=conditions, params=params):
+                    st.rerun()
+        with col2:
+            if st.button(f"❌ رفض المحدد ({len(selected_ids)})", disabled=not selected_ids):
+                if resolve_requests(False, request_ids=selected_ids):
+                    st.rerun()
+            if st.button(f"❌ رفض كل المطابق ({total})"):
+                if resolve_requests(False, conditions=conditions, params=params):
+                    st.rerun()
     else:
         st.info("لا توجد طلبات تفعيل معلقة حاليًا.")
+
+elif selected_option == "صيانة القاعدة":
+    st.header("أرشفة البيانات القديمة")
+    st.write("نقل طلبات التفعيل المحسومة القديمة والمستخدمين غير المفعلين الذين لم ينشطوا منذ مدة إلى جداول الأرشيف، ثم استعادة المساحة.")
+    request_days = st.number_input("أرشفة الطلبات المحسومة الأقدم من (يوم):", min_value=0, value=REQUEST_RETENTION_DAYS)
+    user_days = st.number_input("أرشفة المستخدمين غير المفعلين غير النشطين منذ (يوم):", min_value=1, value=USER_RETENTION_DAYS)
+    if st.button("🧹 تشغيل الأرشفة"):
+        try:
+            with st.spinner("جاري الأرشفة..."):
+                result = archive_stale_rows(request_days, user_days)
+            st.success(f"أُرشف {result['requests']} طلب و{result['users']} مستخدم، واستُعيد {result['freed_bytes'] / 1024:.0f} ك.ب.")
+        except Exception as e:
+            st.error(f"حدث خطأ أثناء الأرشفة: {e}")
+
+elif selected_option == "مقاييس الأداء":
+    st.header("مقاييس الأداء")
+    render_metrics()
@@ -0,0 +1,191 @@
+"""الوصول المشترك إلى قاعدة بيانات المستخدمين من التطبيق ولوحة التحكم.
+
+مجموعة اتصالات لكل عملية بدل فتح اتصال جديد لكل استعلام: كل اتصال مضبوط على WAL
+(القراء لا ينتظرون الكاتب) ومهلة انشغال بدل خطأ "database is locked" الفوري، مع ذاكرة
+للاستعلامات المترجمة. إنشاء الجداول وتطبيق الترحيلات يتم مرة واحدة لكل عملية عند أول اتصال.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "user_data.db")
+POOL_SIZE = 8 # أقصى عدد اتصالات خاملة محفوظة في المجموعة
+BUSY_TIMEOUT = 10 # ثوانٍ ينتظرها الاتصال إذا كانت القاعدة مقفلة للكتابة
+STATEMENT_CACHE_SIZE = 128 # الاستعلامات المترجمة المحفوظة لكل اتصال
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        is_activated INTEGER DEFAULT 0,
+        trial_start_time REAL,
+        last_activity_time REAL,
+        activation_code_used TEXT
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS activation_codes (
+        code TEXT PRIMARY KEY,
+        is_used INTEGER DEFAULT 0,
+        used_by_user_id TEXT,
+        FOREIGN KEY (used_by_user_id) REFERENCES users(user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS activation_requests (
+        request_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        activation_code TEXT,
+        request_time REAL NOT NULL,
+        status TEXT DEFAULT 'pending', -- 'pending', 'approved', 'rejected'
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (activation_code) REFERENCES activation_codes(code)
+    )
+    ''',
+)
+
+# ترحيلات القاعدة بالترتيب؛ رقم آخر ترحيل مطبق محفوظ في PRAGMA user_version.
+# يُضاف الترحيل الجديد في آخر القائمة ولا يُعدل ترحيل سبق تطبيقه.
+MIGRATIONS = (
+    # 1: فهارس الفلترة والترتيب في صفحات لوحة التحكم (مع المفتاح لثبات ترتيب الصفحات)، وآخر طلب لكل مستخدم
+    (
+        "CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity_time, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_trial_start ON users (trial_start_time, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_activated ON users (is_activated, last_activity_time, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_codes_used ON activation_codes (is_used, code)",
+        "CREATE INDEX IF NOT EXISTS idx_codes_user ON activation_codes (used_by_user_id, code)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_status_time ON activation_requests (status, request_time)",
+        "CREATE INDEX IF NOT EXISTS idx_requests_user_time ON activation_requests (user_id, request_time)",
+    ),
+    # 2: جداول الأرشيف لعملية الصيانة (db_maintenance)، بنفس أعمدة الجداول الأصلية ووقت النقل
+    (
+        '''
+        CREATE TABLE IF NOT EXISTS users_archive (
+            user_id TEXT PRIMARY KEY,
+            is_activated INTEGER DEFAULT 0,
+            trial_start_time REAL,
+            last_activity_time REAL,
+            activation_code_used TEXT,
+            archived_at REAL NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS activation_requests_archive (
+            request_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            activation_code TEXT,
+            request_time REAL NOT NULL,
+            status TEXT,
+            archived_at REAL NOT NULL
+        )
+        ''',
+    ),
+)
+
+_pool = []
+_pool_lock = threading.Lock()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def _open():
+    # الاتصال ينتقل بين خيوط الجلسات عبر المجموعة، لكنه لا يُستخدم من خيطين في نفس الوقت
+    conn = sqlite3.connect(DATABASE_FILE, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA synchronous = NORMAL") # آمن مع WAL ويوفر fsync عند كل commit
+    return conn
+
+
+def init_db(conn):
+    """ضبط القاعدة على WAL وإنشاء الجداول إذا لم تكن موجودة ثم تطبيق الترحيلات الناقصة."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    migrate(conn)
+
+
+def migrate(conn):
+    """تطبيق ترحيلات MIGRATIONS التي لم تطبق بعد، كل ترحيل في معاملة مع رفع user_version."""
+    for version, statements in enumerate(MIGRATIONS, 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # يُقرأ الرقم داخل المعاملة، فلا تطبق عمليتان الترحيل نفسه
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+def _acquire():
+    global _initialized
+    with _pool_lock:
+        conn = _pool.pop() if _pool else None
+    if conn is None:
+        conn = _open()
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_db(conn)
+                _initialized = True
+    return conn
+
+
+def _release(conn):
+    with _pool_lock:
+        if len(_pool) < POOL_SIZE:
+            _pool.append(conn)
+            return
+    conn.close()
+
+
+@contextmanager
+def connection():
+    """اتصال من المجموعة؛ يُثبَّت ما كُتب عند الخروج ويُتراجع عنه عند حدوث خطأ."""
+    conn = _acquire()
+    try:
+        yield conn
+        with metrics.timer("db.commit"):
+            conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _release(conn)
+
+
+@contextmanager
+def transaction():
+    """معاملة كتابة تحجز القفل من بدايتها (BEGIN IMMEDIATE)، للقراءة ثم التعديل دون تعارض."""
+    with connection() as conn:
+        # زمن انتظار قفل الكتابة، ثم زمن حجزه حتى نهاية المعاملة
+        with metrics.timer("db.lock_wait"):
+            conn.execute("BEGIN IMMEDIATE")
+        with metrics.timer("db.transaction"):
+            yield conn
+
+
+def query_one(sql, params=()):
+    with metrics.timer("db.query"), connection() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def query_all(sql, params=()):
+    with metrics.timer("db.query"), connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def execute(sql, params=()):
+    """تنفيذ عبارة كتابة واحدة وإعادة عدد الصفوف المتأثرة."""
+    with metrics.timer("db.execute"), connection() as conn:
+        return conn.execute(sql, params).rowcount
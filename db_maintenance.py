@@ -0,0 +1,115 @@
+"""صيانة قاعدة المستخدمين: نقل الصفوف القديمة من الجداول المستخدمة باستمرار إلى جداول الأرشيف.
+
+تُنقل طلبات التفعيل المحسومة الأقدم من مدة الاحتفاظ، والمستخدمون غير المفعلين الذين لم
+ينشطوا منذ مدة (مع طلباتهم المحسومة)، فتبقى users وactivation_requests وفهارسها صغيرة.
+المستخدم المؤرشف يُعاد من الأرشيف عند عودته (fetch_user_status في التطبيق) فلا تبدأ له
+تجربة جديدة. بعد النقل تُستعاد المساحة بـ incremental_vacuum.
+
+الاستخدام:
+    python db_maintenance.py [--request-days N] [--user-days N] [--batch N] [--no-vacuum]
+"""
+import argparse
+import sys
+import time
+
+import db
+
+REQUEST_RETENTION_DAYS = 30 # الطلبات المحسومة الأحدث من ذلك تبقى (تعرض للمستخدم حالة طلبه)
+USER_RETENTION_DAYS = 90 # المستخدم غير المفعل الذي لم ينشط خلالها يُؤرشف
+ARCHIVE_BATCH_SIZE = 5000 # صفوف كل معاملة، حتى لا يُحجز قفل الكتابة طويلًا عن التطبيق
+
+USER_COLUMNS = "user_id, is_activated, trial_start_time, last_activity_time, activation_code_used"
+REQUEST_COLUMNS = "request_id, user_id, activation_code, request_time, status"
+
+# مستخدم غير مفعل لم ينشط منذ الحد، وليس له طلب معلق ولا كود مرتبط به
+STALE_USERS = '''
+    SELECT user_id FROM users
+    WHERE is_activated = 0
+      AND COALESCE(last_activity_time, trial_start_time, 0) < :user_cutoff
+      AND user_id NOT IN (SELECT user_id FROM activation_requests WHERE status = 'pending')
+      AND user_id NOT IN (SELECT used_by_user_id FROM activation_codes WHERE used_by_user_id IS NOT NULL)
+'''
+ARCHIVED_REQUESTS = f"status != 'pending' AND (request_time < :request_cutoff OR user_id IN ({STALE_USERS}))"
+ARCHIVED_USERS = f"user_id IN ({STALE_USERS})"
+
+
+def _move(table, archive, columns, condition, params, batch_size):
+    """نقل الصفوف المطابقة إلى جدول الأرشيف على دفعات، كل دفعة في معاملة؛ يعيد عدد المنقول."""
+    if batch_size < 1:
+        # دفعة فارغة لا تنقل شيئًا فلا تنتهي الحلقة أبدًا
+        raise ValueError("حجم الدفعة يجب أن يكون 1 أو أكثر")
+    moved = 0
+    batch = f"SELECT rowid FROM {table} WHERE {condition} ORDER BY rowid LIMIT :batch_size"
+    params = dict(params, batch_size=batch_size, archived_at=time.time())
+    while True:
+        with db.transaction() as conn:
+            conn.execute(f'''
+                INSERT OR REPLACE INTO {archive} ({columns}, archived_at)
+                SELECT {columns}, :archived_at FROM {table} WHERE rowid IN ({batch})
+            ''', params)
+            count = conn.execute(f"DELETE FROM {table} WHERE rowid IN ({batch})", params).rowcount
+        moved += count
+        if count < batch_size:
+            return moved
+
+
+def reclaim_space():
+    """إعادة الصفحات الفارغة إلى نظام الملفات؛ يعيد عدد البايتات المستعادة.
+
+    أول تشغيل يحول القاعدة إلى auto_vacuum = INCREMENTAL، وهذا يتطلب VACUUM كاملًا مرة واحدة.
+    """
+    with db.connection() as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+    return (before - after) * page_size
+
+
+def archive_stale_rows(request_days=REQUEST_RETENTION_DAYS, user_days=USER_RETENTION_DAYS,
+                       batch_size=ARCHIVE_BATCH_SIZE, vacuum=True):
+    """تنفيذ الصيانة كاملة؛ يعيد {"requests": عدد الطلبات، "users": عدد المستخدمين، "freed_bytes": المساحة المستعادة}."""
+    now = time.time()
+    params = {"request_cutoff": now - request_days * 86400, "user_cutoff": now - user_days * 86400}
+    # الطلبات أولًا، لأن شرطها يعتمد على المستخدمين قبل نقلهم
+    requests = _move("activation_requests", "activation_requests_archive", REQUEST_COLUMNS, ARCHIVED_REQUESTS, params, batch_size)
+    users = _move("users", "users_archive", USER_COLUMNS, ARCHIVED_USERS, params, batch_size)
+    freed = reclaim_space() if vacuum else 0
+    return {"requests": requests, "users": users, "freed_bytes": freed}
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ليس عددًا صحيحًا: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError("يجب أن يكون 1 أو أكثر")
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="أرشفة طلبات التفعيل المحسومة والمستخدمين غير النشطين.")
+    parser.add_argument("--request-days", type=float, default=REQUEST_RETENTION_DAYS,
+                        help=f"أرشفة الطلبات المحسومة الأقدم من هذا العدد من الأيام (الافتراضي: {REQUEST_RETENTION_DAYS})")
+    parser.add_argument("--user-days", type=float, default=USER_RETENTION_DAYS,
+                        help=f"أرشفة المستخدمين غير المفعلين الذين لم ينشطوا منذ هذا العدد من الأيام (الافتراضي: {USER_RETENTION_DAYS})")
+    parser.add_argument("--batch", type=_positive_int, default=ARCHIVE_BATCH_SIZE, help=f"صفوف كل معاملة (الافتراضي: {ARCHIVE_BATCH_SIZE})")
+    parser.add_argument("--no-vacuum", action="store_true", help="عدم استعادة المساحة بعد الأرشفة")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    result = archive_stale_rows(args.request_days, args.user_days, args.batch, not args.no_vacuum)
+    print(
+        f"أُرشف {result['requests']} طلب و{result['users']} مستخدم، "
+        f"واستُعيد {result['freed_bytes'] / 1024:.0f} ك.ب خلال {time.perf_counter() - start:.2f} ث"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
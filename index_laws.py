@@ -0,0 +1,49 @@
+"""فهرسة ملفات القوانين مسبقًا قبل تشغيل التطبيق، حتى لا يدفع أي مستخدم ثمن التحليل.
+
+الاستخدام:
+    python index_laws.py [--root DIR] [--force] [--workers N] [--neighbours K]
+"""
+import argparse
+import os
+import sys
+import time
+
+from law_corpus import refresh_corpus, save_mapped_corpus
+from law_fts import sync_index
+from law_similar import NEIGHBOURS_K, build_similarity_index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="فهرسة ملفات القوانين (تحليل الملفات الجديدة أو المعدلة فقط).")
+    parser.add_argument("--root", default=".", help="المجلد الذي يحتوي على مجلدات القوانين (الافتراضي: المجلد الحالي)")
+    parser.add_argument("--force", action="store_true", help="إعادة تحليل جميع الملفات وتجاهل التخزين المؤقت")
+    parser.add_argument("--workers", type=int, default=None, help="عدد العمليات لتحليل الملفات (الافتراضي: عدد المعالجات، 1 = متسلسل)")
+    parser.add_argument("--neighbours", type=int, default=NEIGHBOURS_K,
+                        help=f"عدد المواد ذات الصلة المحسوبة مسبقًا لكل مادة (الافتراضي: {NEIGHBOURS_K}، 0 = عند الطلب فقط)")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    # يستخدم التطبيق مسارات المجلدات نسبةً إلى مجلد التشغيل، لذا نعمل من داخل الجذر
+    os.chdir(args.root)
+    corpus, changes = refresh_corpus(".", force=args.force, workers=args.workers)
+    sync_index(corpus)
+    save_mapped_corpus(corpus, ".")
+    build_similarity_index(corpus, args.neighbours)
+    elapsed = time.perf_counter() - start
+
+    for label, key in (("مضاف", "added"), ("معدل", "changed"), ("محذوف", "removed")):
+        for path in changes[key]:
+            print(f"{label}: {path}")
+    for path, error in corpus.errors.items():
+        print(f"خطأ: {path}: {error}", file=sys.stderr)
+    print(
+        f"النسخة {corpus.version}: {len(corpus.law_files)} ملف، {corpus.article_count()} مادة "
+        f"(مضاف {len(changes['added'])}، معدل {len(changes['changed'])}، "
+        f"محذوف {len(changes['removed'])}، دون تغيير {len(changes['unchanged'])}) "
+        f"خلال {elapsed:.2f} ث"
+    )
+    return 1 if corpus.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,506 @@
+import os
+import re
+import json
+import time
+import hashlib
+import pickle
+import threading
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from docx import Document
+
+import metrics
+from arabic_text import get_normalized_texts
+from law_mmap import MappedCorpusFile, write_corpus_file
+
+# مجلد التخزين المؤقت للقوانين المحللة (بجوار التطبيق)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".law_cache")
+CACHE_FORMAT_VERSION = 2 # يجب زيادته عند تغيير طريقة التحليل أو شكل السجلات
+
+ARTICLE_PATTERN = re.compile(r"مادة\s*\(?\s*(\d+)\)?")
+UNKNOWN_ARTICLE_NUM = "غير معروفة"
+
+# عدد العمليات لتحليل الملفات عند الفهرسة الباردة (1 = تحليل متسلسل)
+PARSE_WORKERS = int(os.environ.get("LAW_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+CORPUS_CHECK_INTERVAL = 5 # أقل عدد ثوانٍ بين فحصين لمجلدات القوانين
+EXCLUDED_FOLDERS = {".git", ".streamlit", "__pycache__", os.path.basename(CACHE_DIR)}
+
+# سجل مادة واحدة: اسم القانون، رقم المادة، وفقرات المادة
+Article = namedtuple("Article", ["law", "num", "paragraphs"])
+# ملف قانون داخل نسخة المكتبة: المجلد، المسار، اسم القانون، والمواد
+LawFile = namedtuple("LawFile", ["folder", "path", "law", "articles"])
+
+# ذاكرة مشتركة بين جميع الجلسات داخل نفس العملية: المسار -> (الحجم، وقت التعديل، البصمة، المواد)
+_memory_cache = {}
+_memory_lock = threading.Lock()
+_path_locks = {}
+
+
+def law_name_from_path(path):
+    """استخراج اسم القانون من مسار الملف."""
+    return os.path.basename(path).replace(".docx", "")
+
+
+def file_sha256(path):
+    """حساب بصمة محتوى الملف."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def segment_articles(law_name, paragraphs):
+    """تقسيم فقرات القانون إلى مواد حسب عناوين (مادة N)."""
+    articles = []
+    current_article_paragraphs = []
+    last_article_num = UNKNOWN_ARTICLE_NUM
+
+    for para_text in paragraphs:
+        match = ARTICLE_PATTERN.match(para_text)
+        if match:
+            if current_article_paragraphs:
+                articles.append(Article(law_name, last_article_num, tuple(current_article_paragraphs)))
+                current_article_paragraphs = []
+            last_article_num = match.group(1)
+        current_article_paragraphs.append(para_text)
+
+    if current_article_paragraphs:
+        articles.append(Article(law_name, last_article_num, tuple(current_article_paragraphs)))
+    return tuple(articles)
+
+
+def parse_law_file(path):
+    """قراءة ملف Word وتحويله إلى سجلات مواد."""
+    with metrics.timer("corpus.parse_docx"):
+        doc = Document(path)
+        # تنظيف المسافات غير المنقسمة والمسافات الصفرية مرة واحدة هنا بدل كل عملية بحث
+        paragraphs = [p.text.replace('\xa0', ' ').replace('\u200b', '').strip() for p in doc.paragraphs]
+        paragraphs = [p for p in paragraphs if p]
+    with metrics.timer("corpus.segment"):
+        return segment_articles(law_name_from_path(path), paragraphs)
+
+
+def _cache_file_for(path):
+    key = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.pkl")
+
+
+def _read_disk_cache(path):
+    try:
+        with open(_cache_file_for(path), "rb") as f:
+            entry = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+    if entry.get("format") != CACHE_FORMAT_VERSION or entry.get("path") != os.path.abspath(path):
+        return None
+    return entry
+
+
+def _write_disk_cache(path, entry):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    target = _cache_file_for(path)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, target) # استبدال ذري حتى لا تقرأ عملية أخرى ملفًا ناقصًا
+    except OSError:
+        # فشل الكتابة لا يمنع البحث، سنعيد التحليل لاحقًا فقط
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _lock_for(path):
+    with _memory_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = threading.Lock()
+        return lock
+
+
+def load_law_articles(path):
+    """الحصول على مواد القانون من الذاكرة أو من القرص، مع التحليل مرة واحدة فقط عند التغيير.
+
+    المفتاح هو المسار + وقت التعديل + بصمة المحتوى: إذا تغير وقت التعديل فقط ولم يتغير
+    المحتوى تُستخدم النسخة المخزنة دون إعادة تحليل.
+    """
+    return _load_law_entry(path)[1]
+
+
+def _lookup_law_entry(path, st_info):
+    """البحث عن مواد الملف في الذاكرة ثم القرص. تعيد (البصمة، المواد) والمواد None عند الحاجة للتحليل."""
+    cached = _memory_cache.get(path)
+    if cached and cached[0] == st_info.st_size and cached[1] == st_info.st_mtime_ns:
+        return cached[2], cached[3]
+
+    entry = _read_disk_cache(path)
+    if entry and entry["size"] == st_info.st_size and entry["mtime_ns"] == st_info.st_mtime_ns:
+        _remember_law_entry(path, st_info, entry["sha256"], entry["articles"])
+        return entry["sha256"], entry["articles"]
+
+    sha = file_sha256(path)
+    if entry and entry["sha256"] == sha:
+        # تغير وقت التعديل فقط ولم يتغير المحتوى
+        _store_law_entry(path, st_info, sha, entry["articles"])
+        return sha, entry["articles"]
+    return sha, None
+
+
+def _remember_law_entry(path, st_info, sha, articles):
+    with _memory_lock:
+        _memory_cache[path] = (st_info.st_size, st_info.st_mtime_ns, sha, articles)
+
+
+def _store_law_entry(path, st_info, sha, articles):
+    _write_disk_cache(path, {
+        "format": CACHE_FORMAT_VERSION,
+        "path": path,
+        "size": st_info.st_size,
+        "mtime_ns": st_info.st_mtime_ns,
+        "sha256": sha,
+        "articles": articles,
+    })
+    _remember_law_entry(path, st_info, sha, articles)
+
+
+def _load_law_entry(path):
+    path = os.path.abspath(path)
+    st_info = os.stat(path)
+
+    cached = _memory_cache.get(path)
+    if cached and cached[0] == st_info.st_size and cached[1] == st_info.st_mtime_ns:
+        return cached[2], cached[3]
+
+    with _lock_for(path):
+        # ربما أنهت جلسة أخرى التحليل أثناء انتظار القفل
+        sha, articles = _lookup_law_entry(path, st_info)
+        if articles is None:
+            articles = parse_law_file(path)
+            _store_law_entry(path, st_info, sha, articles)
+        return sha, articles
+
+
+def _parse_worker(path):
+    """تعمل داخل عملية فرعية: تحليل ملف واحد وإعادة سجلات مضغوطة (رقم المادة، الفقرات)."""
+    return [(article.num, article.paragraphs) for article in parse_law_file(path)]
+
+
+def parse_law_files(paths, workers=None):
+    """تحليل عدة ملفات على مجموعة عمليات (تحليل XML يستهلك المعالج)، مع التراجع للتحليل المتسلسل.
+
+    تعيد قاموس: المسار -> المواد، أو الاستثناء إذا تعذر تحليل الملف.
+    """
+    workers = PARSE_WORKERS if workers is None else workers
+    workers = min(workers, len(paths))
+    results = {}
+    if workers > 1:
+        try:
+            # spawn بدل fork لأن خادم Streamlit متعدد الخيوط
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = {pool.submit(_parse_worker, path): path for path in paths}
+                for future in as_completed(futures):
+                    path = futures[future]
+                    try:
+                        law_name = law_name_from_path(path)
+                        results[path] = tuple(Article(law_name, num, paragraphs) for num, paragraphs in future.result())
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        results[path] = e
+        except (OSError, BrokenProcessPool):
+            # لا يمكن تشغيل عمليات فرعية في هذه البيئة؛ نكمل ما تبقى بالتسلسل
+            pass
+    for path in paths:
+        if path not in results:
+            try:
+                results[path] = parse_law_file(path)
+            except Exception as e:
+                results[path] = e
+    return results
+
+
+def _evict_disk_cache(path):
+    try:
+        os.remove(_cache_file_for(path))
+    except OSError:
+        pass
+    with _memory_lock:
+        _memory_cache.pop(os.path.abspath(path), None)
+
+
+def list_law_folders(root="."):
+    """قائمة مجلدات القوانين داخل المجلد الجذر."""
+    return sorted(
+        f.path for f in os.scandir(root)
+        if f.is_dir() and f.name not in EXCLUDED_FOLDERS and not f.name.startswith(".")
+    )
+
+
+def scan_law_files(folders):
+    """حصر ملفات Word في المجلدات مع الحجم ووقت التعديل (دون فتحها)."""
+    found = {}
+    for folder in folders:
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.endswith(".docx") and entry.is_file():
+                st_info = entry.stat()
+                found[os.path.abspath(entry.path)] = {
+                    "folder": folder,
+                    "size": st_info.st_size,
+                    "mtime_ns": st_info.st_mtime_ns,
+                }
+    return found
+
+
+def _root_key(root):
+    return hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:12]
+
+
+def manifest_file_for(root):
+    """مسار ملف البيان الخاص بمجلد جذر معين."""
+    return os.path.join(CACHE_DIR, f"manifest-{_root_key(root)}.json")
+
+
+def mapped_corpus_file_for(root):
+    """مسار ملف المكتبة الثنائي (mmap) الخاص بمجلد جذر معين."""
+    return os.path.join(CACHE_DIR, f"corpus-{_root_key(root)}.bin")
+
+
+def save_mapped_corpus(corpus, root="."):
+    """كتابة ملف المكتبة الثنائي الذي تفتحه عمليات التطبيق بـ mmap (يُستدعى من أداة الفهرسة).
+
+    تعيد False إذا كان الملف الموجود لنفس النسخة فلم يُعد كتابته.
+    """
+    path = mapped_corpus_file_for(root)
+    try:
+        if MappedCorpusFile(path).version == corpus.version:
+            return False
+    except (OSError, ValueError):
+        pass
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # النصوص الموحدة وخرائط مواضعها تُكتب أيضًا، فلا تعيد كل عملية حسابها
+    normalized = iter(get_normalized_texts(corpus))
+    write_corpus_file(path, corpus.version, (
+        (lf.folder, lf.path, lf.law, [(a.num, a.paragraphs) + tuple(next(normalized)) for a in lf.articles])
+        for lf in corpus.law_files
+    ))
+    return True
+
+
+def _open_mapped_corpus(root, version):
+    """ملف المكتبة الثنائي ومواده لكل مسار إذا كان لنسخة البيان المتوقعة، وإلا (None، قاموس فارغ)."""
+    try:
+        mapped = MappedCorpusFile(mapped_corpus_file_for(root))
+    except (OSError, ValueError):
+        return None, {}
+    if mapped.version != version:
+        return None, {}
+    return mapped, {
+        law_path: tuple(Article(law, num, paragraphs) for num, paragraphs in law_articles)
+        for _, law_path, law, law_articles in mapped.iter_laws()
+    }
+
+
+def read_manifest(root="."):
+    """قراءة بيان الملفات المفهرسة من القرص."""
+    try:
+        with open(manifest_file_for(root), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("format") != CACHE_FORMAT_VERSION:
+        return {}
+    return manifest.get("files", {})
+
+
+def write_manifest(files, root="."):
+    """حفظ بيان الملفات المفهرسة بشكل ذري."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    manifest_file = manifest_file_for(root)
+    tmp_path = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"format": CACHE_FORMAT_VERSION, "files": files}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_file)
+
+
+def corpus_version(files):
+    """رقم نسخة المكتبة: بصمة مشتقة من مسارات الملفات وبصمات محتواها (دون الملفات التي تعذر تحليلها)."""
+    h = hashlib.sha1(str(CACHE_FORMAT_VERSION).encode())
+    for path in sorted(files):
+        if "error" in files[path]:
+            continue
+        h.update(path.encode("utf-8"))
+        h.update(files[path]["sha256"].encode())
+    return h.hexdigest()[:16]
+
+
+class Corpus:
+    """نسخة ثابتة من مواد جميع القوانين.
+
+    لا تُعدل النسخة بعد إنشائها؛ عند تغير الملفات تُبنى نسخة جديدة وتُستبدل بها الحالية،
+    فتكمل عمليات البحث الجارية على النسخة القديمة التي تحمل مرجعًا إليها.
+    """
+
+    def __init__(self, version, folders, manifest, law_files, errors, mapped=None):
+        self.version = version
+        self.folders = tuple(folders)
+        self.manifest = manifest
+        self.law_files = tuple(law_files)
+        self.errors = errors
+        # ملف المكتبة المشترك إذا كانت مواده هي مواد هذه النسخة بنفس الترتيب، وإلا None
+        self.mapped = mapped
+        self._derived = {}
+        self._derived_lock = threading.RLock() # المشتقات قد تعتمد على مشتقات أخرى
+
+    def iter_law_files(self, folder=None):
+        """ملفات القوانين في مجلد معين أو في كل المجلدات."""
+        for law_file in self.law_files:
+            if folder is None or law_file.folder == folder:
+                yield law_file
+
+    def article_count(self):
+        return sum(len(law_file.articles) for law_file in self.law_files)
+
+    def entries(self):
+        """جميع المواد كقائمة مسطحة من (ملف القانون، المادة)؛ موضع المادة فيها هو رقمها في الفهارس."""
+        return self.derived("entries", lambda corpus: [
+            (law_file, article) for law_file in corpus.law_files for article in law_file.articles
+        ])
+
+    def article_id(self, path, ordinal):
+        """رقم المادة في corpus.entries() من مسار ملفها وترتيبها داخله."""
+        starts = self.derived("file_starts", _file_starts)
+        return starts[path] + ordinal
+
+    def derived(self, key, builder):
+        """فهرس مشتق من هذه النسخة (مثل فهرس الثلاثيات) يُبنى مرة واحدة عند أول طلب."""
+        value = self._derived.get(key)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = self._derived[key] = builder(self)
+        return value
+
+
+def _file_starts(corpus):
+    starts = {}
+    offset = 0
+    for law_file in corpus.law_files:
+        starts[law_file.path] = offset
+        offset += len(law_file.articles)
+    return starts
+
+
+_current_corpus = None
+_last_check_time = 0.0
+_refresh_lock = threading.Lock()
+
+
+def refresh_corpus(root=".", force=False, workers=None):
+    """مقارنة البيان المخزن بالمجلدات وإعادة تحليل الملفات المتغيرة فقط (على عدة عمليات).
+
+    تعيد (النسخة الجديدة، التغييرات) حيث التغييرات قاموس بالملفات المضافة والمعدلة والمحذوفة.
+    """
+    global _current_corpus, _last_check_time
+    with _refresh_lock:
+        previous = _current_corpus
+        old_manifest = previous.manifest if previous else read_manifest(root)
+        old_files = {lf.path: lf for lf in previous.law_files} if previous else {}
+        # عند بدء العملية: مواد الملفات غير المتغيرة تُقرأ من ملف المكتبة المشترك دون تحليل أو فك
+        mapped_file, mapped = (None, {}) if previous is not None or force else _open_mapped_corpus(root, corpus_version(old_manifest))
+
+        folders = list_law_folders(root)
+        found = scan_law_files(folders)
+
+        changes = {"added": [], "changed": [], "removed": [], "unchanged": []}
+        manifest = {}
+        loaded = {}
+        errors = {}
+        to_parse = {}
+        for path, info in found.items():
+            old = old_manifest.get(path)
+            same_stat = old and old["size"] == info["size"] and old["mtime_ns"] == info["mtime_ns"]
+            if same_stat and not force and "error" in old:
+                # تعذر تحليله سابقًا ولم يتغير: لا يُعاد تحليله حتى يتغير حجمه أو وقت تعديله
+                manifest[path] = old
+                errors[path] = old["error"]
+                continue
+            if same_stat and not force and (path in old_files or path in mapped):
+                # لم يتغير الملف منذ النسخة السابقة في الذاكرة أو في ملف المكتبة المشترك
+                manifest[path] = old
+                loaded[path] = old_files[path].articles if path in old_files else mapped[path]
+                changes["unchanged"].append(path)
+                continue
+            if force:
+                _evict_disk_cache(path)
+            try:
+                st_info = os.stat(path)
+                sha, articles = _lookup_law_entry(path, st_info)
+            except OSError as e:
+                errors[path] = str(e)
+                continue
+            if articles is None:
+                to_parse[path] = (st_info, sha)
+            else:
+                loaded[path] = articles
+            manifest[path] = dict(info, sha256=sha)
+            if old is None:
+                changes["added"].append(path)
+            elif old.get("sha256") != sha:
+                changes["changed"].append(path)
+            else:
+                changes["unchanged"].append(path)
+
+        for path, result in parse_law_files(list(to_parse), workers).items():
+            if isinstance(result, Exception):
+                errors[path] = str(result)
+                # يبقى في البيان مع الخطأ، فلا يُعاد تحليله في كل فحص ما دام الملف لم يتغير
+                manifest[path]["error"] = errors[path]
+                for paths in changes.values():
+                    if path in paths:
+                        paths.remove(path)
+                continue
+            st_info, sha = to_parse[path]
+            _store_law_entry(path, st_info, sha, result)
+            loaded[path] = result
+
+        law_files = [
+            LawFile(info["folder"], path, law_name_from_path(path), loaded[path])
+            for path, info in found.items() if path in loaded
+        ]
+
+        for path in old_manifest:
+            if path not in found:
+                _evict_disk_cache(path)
+                changes["removed"].append(path)
+
+        version = corpus_version(manifest)
+        if manifest != old_manifest:
+            write_manifest(manifest, root)
+        if (previous is None or previous.manifest != manifest
+                or previous.folders != tuple(folders) or previous.errors != errors):
+            # استبدال ذري للمرجع: عمليات البحث الجارية تكمل على النسخة القديمة
+            if mapped_file is not None and (mapped_file.version != version
+                                            or mapped_file.law_paths() != [lf.path for lf in law_files]):
+                mapped_file = None
+            _current_corpus = Corpus(version, folders, manifest, law_files, errors, mapped_file)
+        _last_check_time = time.monotonic()
+        return _current_corpus, changes
+
+
+def get_corpus(root="."):
+    """النسخة الحالية من المكتبة، مع فحص تغيرات الملفات على فترات متباعدة فقط."""
+    corpus = _current_corpus
+    if corpus is None:
+        return refresh_corpus(root)[0]
+    if time.monotonic() - _last_check_time >= CORPUS_CHECK_INTERVAL and not _refresh_lock.locked():
+        return refresh_corpus(root)[0]
+    return corpus
@@ -0,0 +1,222 @@
+"""تصدير نتائج البحث (Word وCSV وJSON) في الذاكرة عند الطلب، مع كتابة متدفقة للتصديرات الكبيرة."""
+import io
+import os
+import csv
+import json
+import logging
+import re
+import tempfile
+import threading
+import weakref
+import zipfile
+from xml.sax.saxutils import escape
+
+import metrics
+from result_cache import ResultCache
+
+EXPORT_TITLE = "نتائج البحث"
+EXPORT_FORMATS = {
+    "Word": ("docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "CSV": ("csv", "text/csv"),
+    "JSON": ("json", "application/json"),
+}
+# ملفات التصدير الجاهزة تُحفظ في الذاكرة مشتركة بين الجلسات، بحد أقصى للعدد والحجم
+EXPORT_CACHE_MAX_ENTRIES = 32
+EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# فوق هذا العدد من النتائج يُنشأ ملف Word في الخلفية بالكتابة المتدفقة
+LARGE_EXPORT_THRESHOLD = 500
+
+_export_cache = ResultCache(EXPORT_CACHE_MAX_ENTRIES, max_size=EXPORT_CACHE_MAX_BYTES)
+metrics.register_cache("export", _export_cache)
+
+
+def export_filename(fmt):
+    return f"{EXPORT_TITLE}.{EXPORT_FORMATS[fmt][0]}".replace(" ", "_")
+
+
+def export_mime(fmt):
+    return EXPORT_FORMATS[fmt][1]
+
+
+def get_cached_export(key):
+    return _export_cache.get(key)
+
+
+def cache_export(key, data):
+    _export_cache.put(key, data)
+
+
+def export_results_to_docx(results):
+    """إنشاء ملف Word للنتائج في الذاكرة وإعادة محتواه.
+
+    يستخدم نفس كاتب التصدير الكبير حتى لا يختلف شكل المستند باختلاف عدد النتائج.
+    """
+    buffer = io.BytesIO()
+    write_docx_streaming(results, buffer)
+    return buffer.getvalue()
+
+
+def export_results_to_csv(results):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["القانون", "المادة", "النص"])
+    for r in results:
+        writer.writerow([r["law"], r["num"], r["context"]])
+    # utf-8-sig حتى يعرض Excel النص العربي بشكل صحيح
+    return buffer.getvalue().encode("utf-8-sig")
+
+
+def export_results_to_json(results):
+    rows = [{"law": r["law"], "num": r["num"], "text": r["context"]} for r in results]
+    return json.dumps(rows, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+_EXPORTERS = {
+    "Word": export_results_to_docx,
+    "CSV": export_results_to_csv,
+    "JSON": export_results_to_json,
+}
+
+
+def export_results(results, fmt, key=None):
+    """محتوى ملف التصدير بالصيغة المطلوبة، من الذاكرة المؤقتة إن وُجد."""
+    if key is not None:
+        data = get_cached_export(key)
+        if data is not None:
+            return data
+    with metrics.timer(f"export.{fmt.lower()}"):
+        data = _EXPORTERS[fmt](results)
+    if key is not None:
+        cache_export(key, data)
+    return data
+
+
+_CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>'
+)
+_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+_DOCUMENT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/>'
+    '</Relationships>'
+)
+# أنماط العنوان والعنوان الرئيسي 1 بنفس معرفات قالب Word، فتظهر في جزء التنقل كعناوين
+_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:docDefaults><w:rPrDefault><w:rPr><w:sz w:val="22"/><w:szCs w:val="22"/></w:rPr></w:rPrDefault></w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/><w:pPr><w:spacing w:after="300"/></w:pPr>'
+    '<w:rPr><w:b/><w:bCs/><w:sz w:val="40"/><w:szCs w:val="40"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/><w:pPr><w:keepNext/><w:spacing w:before="480"/><w:outlineLvl w:val="0"/></w:pPr>'
+    '<w:rPr><w:b/><w:bCs/><w:sz w:val="28"/><w:szCs w:val="28"/></w:rPr></w:style>'
+    '</w:styles>'
+)
+_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+_DOCUMENT_END = '<w:sectPr/></w:body></w:document>'
+# الأحرف خارج نطاق Char في XML 1.0 (مثل \x0b و\x0c من ملفات Word) تجعل المستند غير قابل للفتح
+_INVALID_XML_CHARS = re.compile("[^\t\n\r\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+
+
+def _paragraph_xml(text, style=None):
+    # ترتيب العناصر داخل pPr وrPr يتبع المخطط (pStyle قبل bidi)؛ الحجم والخط العريض من النمط
+    paragraph_props = f'<w:pStyle w:val="{style}"/>' if style else ""
+    lines = text.split("\n")
+    runs = '<w:r><w:br/></w:r>'.join(
+        f'<w:r><w:rPr><w:rtl/></w:rPr><w:t xml:space="preserve">{escape(_INVALID_XML_CHARS.sub("", line))}</w:t></w:r>' for line in lines
+    )
+    return f'<w:p><w:pPr>{paragraph_props}<w:bidi/></w:pPr>{runs}</w:p>'
+
+
+def write_docx_streaming(results, fileobj, progress=None, cancel_event=None):
+    """كتابة ملف Word مباشرة إلى ملف، فقرة بعد فقرة، دون بناء المستند كاملًا في الذاكرة."""
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", _RELS_XML)
+        zf.writestr("word/_rels/document.xml.rels", _DOCUMENT_RELS_XML)
+        zf.writestr("word/styles.xml", _STYLES_XML)
+        with zf.open("word/document.xml", "w", force_zip64=True) as out:
+            out.write(_DOCUMENT_START.encode("utf-8"))
+            out.write(_paragraph_xml(EXPORT_TITLE, style="Title").encode("utf-8"))
+            for i, r in enumerate(results, 1):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                out.write(_paragraph_xml(f'{r["law"]} - المادة {r["num"]}', style="Heading1").encode("utf-8"))
+                out.write(_paragraph_xml(r["context"]).encode("utf-8"))
+                if progress is not None:
+                    progress(i)
+            out.write(_DOCUMENT_END.encode("utf-8"))
+
+
+class ExportJob:
+    """تصدير كبير إلى ملف Word مؤقت في خيط خلفي.
+
+    results قد تكون مولِّدًا يشتق كل صف عند كتابته، فلا تُجمع النتائج كاملة في الذاكرة.
+    """
+
+    def __init__(self, results, total, key=None):
+        self.total = total
+        self.written = 0
+        self.error = None
+        self.finished = False
+        self.key = key
+        self.cancel_event = threading.Event()
+        fd, self.path = tempfile.mkstemp(prefix="law_export_", suffix=".docx")
+        os.close(fd)
+        # إذا تُركت الجلسة أثناء التصدير يُحذف الملف عند تحرير المهمة من حالة الجلسة أو عند إغلاق العملية
+        self._finalizer = weakref.finalize(self, _remove_file, self.path)
+        self._thread = threading.Thread(target=self._run, args=(results,), daemon=True)
+        self._thread.start()
+
+    def _run(self, results):
+        try:
+            with metrics.timer("export.docx_stream"), open(self.path, "wb") as f:
+                write_docx_streaming(results, f, progress=self._progress, cancel_event=self.cancel_event)
+        except Exception as e:
+            self.error = e
+            metrics.log_event("export_failed", logging.ERROR, error=repr(e))
+        finally:
+            self.finished = True
+
+    def _progress(self, written):
+        self.written = written
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def discard(self):
+        """إيقاف المهمة وحذف ملفها المؤقت."""
+        self.cancel_event.set()
+        self._thread.join()
+        self._finalizer()
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
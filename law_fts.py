@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+
+import metrics
+from arabic_text import normalize
+
+# فهرس البحث النصي الكامل للمواد، في ملف مستقل بجوار قاعدة بيانات المستخدمين
+INDEX_DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "laws_index.db")
+
+# معرف الصف = رقم الملف * ROWID_STRIDE + ترتيب المادة داخل الملف،
+# حتى يمكن حذف مواد ملف كامل أو تقييد البحث بقانون واحد بنطاق rowid
+ROWID_STRIDE = 1_000_000
+# محلل الثلاثيات يحافظ على سلوك "يحتوي على" الحالي، لكنه لا يطابق الكلمات الأقصر من 3 أحرف
+MIN_FTS_KEYWORD_LENGTH = 3
+# يجب زيادته عند تغيير ما يُخزن في الفهرس؛ عندها يُعاد بناء الفهرس كاملًا
+INDEX_FORMAT_VERSION = 2 # 2: النص الموحد (دون حركات وبصور حروف موحدة)
+
+_sync_lock = threading.Lock()
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def connect_index():
+    """فتح اتصال بالفهرس، مع إنشاء الجداول مرة واحدة فقط لكل عملية."""
+    global _initialized
+    conn = sqlite3.connect(INDEX_DATABASE_FILE, timeout=30)
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                init_index(conn)
+                _initialized = True
+    return conn
+
+
+def init_index(conn):
+    """إنشاء جداول الفهرس إذا لم تكن موجودة."""
+    c = conn.cursor()
+    c.execute("PRAGMA journal_mode=WAL") # القراءة أثناء إعادة الفهرسة لا تنتظر الكاتب
+    c.execute("CREATE TABLE IF NOT EXISTS index_meta (key TEXT PRIMARY KEY, value TEXT)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS indexed_files (
+            file_id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            sha256 TEXT NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+            body, law UNINDEXED, num UNINDEXED, tokenize = 'trigram'
+        )
+    ''')
+    conn.commit()
+
+
+def index_version_for(corpus):
+    return f"{INDEX_FORMAT_VERSION}:{corpus.version}"
+
+
+def get_index_version(conn):
+    row = conn.execute("SELECT value FROM index_meta WHERE key = 'corpus_version'").fetchone()
+    return row[0] if row else None
+
+
+def sync_index(corpus):
+    """تحديث الفهرس ليطابق نسخة المكتبة: إضافة الملفات الجديدة أو المعدلة وحذف المحذوفة فقط."""
+    with _sync_lock:
+        conn = connect_index()
+        try:
+            if get_index_version(conn) == index_version_for(corpus):
+                return False
+            c = conn.cursor()
+            row = c.execute("SELECT value FROM index_meta WHERE key = 'index_format'").fetchone()
+            if row is None or row[0] != str(INDEX_FORMAT_VERSION):
+                c.execute("DELETE FROM articles_fts")
+                c.execute("DELETE FROM indexed_files")
+                c.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES ('index_format', ?)", (str(INDEX_FORMAT_VERSION),))
+            indexed = {path: (file_id, sha) for file_id, path, sha in c.execute("SELECT file_id, path, sha256 FROM indexed_files")}
+            current = {law_file.path: law_file for law_file in corpus.law_files}
+
+            for path, (file_id, sha) in indexed.items():
+                if path not in current or corpus.manifest[path]["sha256"] != sha:
+                    c.execute("DELETE FROM articles_fts WHERE rowid >= ? AND rowid < ?",
+                              (file_id * ROWID_STRIDE, (file_id + 1) * ROWID_STRIDE))
+                    c.execute("DELETE FROM indexed_files WHERE file_id = ?", (file_id,))
+
+            for path, law_file in current.items():
+                sha = corpus.manifest[path]["sha256"]
+                if path in indexed and indexed[path][1] == sha:
+                    continue
+                c.execute("INSERT INTO indexed_files (path, sha256) VALUES (?, ?)", (path, sha))
+                base = c.lastrowid * ROWID_STRIDE
+                c.executemany(
+                    "INSERT INTO articles_fts (rowid, body, law, num) VALUES (?, ?, ?, ?)",
+                    ((base + i, normalize("\n".join(a.paragraphs)), a.law, a.num) for i, a in enumerate(law_file.articles)),
+                )
+
+            c.execute("INSERT OR REPLACE INTO index_meta (key, value) VALUES ('corpus_version', ?)", (index_version_for(corpus),))
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+
+def fts_query_for(keywords):
+    """بناء تعبير MATCH: كل كلمة (بعد توحيدها) عبارة مقتبسة، والكلمات مربوطة بـ OR."""
+    return " OR ".join('"' + normalize(kw).replace('"', '""') + '"' for kw in keywords)
+
+
+def can_use_index(keywords):
+    return bool(keywords) and all(len(normalize(kw)) >= MIN_FTS_KEYWORD_LENGTH for kw in keywords)
+
+
+@metrics.timed("search.fts")
+def search_index(corpus, keywords, paths=None):
+    """البحث في الفهرس مرتبًا حسب bm25، مع تقييد اختياري بمسارات ملفات معينة.
+
+    تعيد قائمة (مسار الملف، ترتيب المادة في الملف، درجة bm25)، أو None إذا كان الفهرس لا يطابق
+    نسخة المكتبة أو كانت الكلمات غير صالحة للفهرس. الدرجة (الأقل أنسب) تُحسب من إحصاءات الفهرس
+    كله حتى مع التقييد بقانون واحد، فتصلح لدمج نتائج عدة قوانين بُحث فيها كلٌّ على حدة.
+    """
+    if not can_use_index(keywords):
+        return None
+    conn = connect_index()
+    try:
+        if get_index_version(conn) != index_version_for(corpus):
+            return None
+        file_ids = dict(conn.execute("SELECT file_id, path FROM indexed_files"))
+        sql = "SELECT rowid, bm25(articles_fts) FROM articles_fts WHERE articles_fts MATCH ?"
+        params = [fts_query_for(keywords)]
+        allowed = None
+        if paths is not None:
+            paths = set(paths)
+            allowed = {file_id for file_id, path in file_ids.items() if path in paths}
+            if not allowed:
+                return []
+            if len(allowed) == 1:
+                # قانون واحد: التقييد يتم داخل الفهرس بنطاق rowid
+                file_id = next(iter(allowed))
+                sql += " AND rowid >= ? AND rowid < ?"
+                params += [file_id * ROWID_STRIDE, (file_id + 1) * ROWID_STRIDE]
+        sql += " ORDER BY bm25(articles_fts)"
+        hits = []
+        for rowid, score in conn.execute(sql, params):
+            file_id, ordinal = divmod(rowid, ROWID_STRIDE)
+            if allowed is None or file_id in allowed:
+                hits.append((file_ids[file_id], ordinal, score))
+        return hits
+    finally:
+        conn.close()
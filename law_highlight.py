@@ -0,0 +1,87 @@
+import re
+from functools import lru_cache
+
+import metrics
+
+
+class KeywordMatcher:
+    """مطابق واحد لجميع الكلمات المفتاحية، يُترجم مرة واحدة لكل استعلام.
+
+    التعبير بديل واحد مرتب من الأطول إلى الأقصر، فيعيد في مرور واحد مواضع غير متداخلة
+    ويفضل الكلمة الأطول عند تداخل كلمتين (مثل "البيع" و"بيع").
+    """
+
+    def __init__(self, keywords):
+        unique = {}
+        for kw in keywords:
+            if kw:
+                unique.setdefault(kw.lower(), kw)
+        ordered = sorted(unique.values(), key=len, reverse=True)
+        self.pattern = re.compile("|".join(re.escape(kw) for kw in ordered), re.IGNORECASE | re.UNICODE) if ordered else None
+
+    def spans(self, text):
+        """مواضع المطابقة (بداية، نهاية) غير المتداخلة في النص."""
+        if self.pattern is None:
+            return []
+        return [m.span() for m in self.pattern.finditer(text)]
+
+
+@lru_cache(maxsize=256)
+def _cached_matcher(keywords):
+    return KeywordMatcher(keywords)
+
+
+def get_matcher(keywords):
+    """المطابق المترجم لمجموعة كلمات (يعاد استخدامه بين النتائج وعمليات إعادة التشغيل)."""
+    return _cached_matcher(tuple(keywords))
+
+
+def merge_spans(spans):
+    """دمج المواضع المتداخلة أو المتلاصقة (مثل مطابقات "أو" والقرب)، مرتبة تصاعديًا."""
+    merged = []
+    for s, e in sorted(spans):
+        if merged and s <= merged[-1][1]:
+            if e > merged[-1][1]:
+                merged[-1] = (merged[-1][0], e)
+        else:
+            merged.append((s, e))
+    return merged
+
+
+@metrics.timed("render.context")
+def extract_context_from_spans(paragraphs, spans, context_lines=3):
+    """استخراج السياق وتظليله مباشرة من مواضع المطابقة في نص المادة ("\\n".join للفقرات).
+
+    تعيد (السياق كنص عادي، السياق مع وسوم <mark>) دون إعادة البحث في النص.
+    """
+    # الوسوم تُدرج من النهاية إلى البداية، فالمواضع المتداخلة تنتج وسومًا متشابكة
+    spans = merge_spans(spans)
+    bounds = []
+    offset = 0
+    for p in paragraphs:
+        bounds.append((offset, offset + len(p)))
+        offset += len(p) + 1 # فاصل السطر بين الفقرات
+
+    marked = {}
+    for i, (p_start, p_end) in enumerate(bounds):
+        inside = [(max(s, p_start) - p_start, min(e, p_end) - p_start) for s, e in spans if s < p_end and e > p_start]
+        if inside:
+            marked[i] = inside
+
+    context_set = set()
+    for idx in marked:
+        for i in range(max(0, idx - context_lines), min(len(paragraphs), idx + context_lines + 1)):
+            context_set.add(i)
+
+    plain_lines = []
+    html_lines = []
+    for i in sorted(context_set):
+        para = paragraphs[i]
+        if not para.strip():
+            continue
+        html = para
+        for s, e in reversed(marked.get(i, [])):
+            html = f"{html[:s]}<mark>{html[s:e]}</mark>{html[e:]}"
+        plain_lines.append(para)
+        html_lines.append(html)
+    return "\n".join(plain_lines), "\n".join(html_lines)
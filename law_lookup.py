@@ -0,0 +1,78 @@
+"""الوصول المباشر إلى مادة برقمها واسم قانونها ("المادة 312 من القانون المدني") دون بحث."""
+import re
+
+from arabic_text import normalize
+
+# يطبق على النص الموحد (ة -> ه)؛ اسم القانون اختياري
+REFERENCE_PATTERN = re.compile(r"^\s*(?:ال)?ماده\s*\(?\s*(\d+)\s*\)?\s*(?:من\s+)?(.*?)\s*$")
+
+
+def normalize_article_num(num):
+    """توحيد رقم المادة (الأرقام العربية الهندية والأصفار البادئة)."""
+    return str(int(num)) if num.isdigit() else num
+
+
+def parse_article_reference(text):
+    """(رقم المادة، اسم القانون كما كُتب أو "") إذا كان النص إشارة إلى مادة، وإلا None."""
+    match = REFERENCE_PATTERN.match(normalize(text))
+    if not match:
+        return None
+    return normalize_article_num(match.group(1)), match.group(2)
+
+
+class ArticleLookup:
+    """فهرس (القانون، رقم المادة) -> أرقام المواد في corpus.entries().
+
+    الرقم قد يتكرر في القانون نفسه (مثل فقرة تبدأ بالإشارة إلى مادة أخرى)، فتُحفظ كل المواد
+    بترتيبها والأولى هي الأرجح.
+    """
+
+    def __init__(self, corpus):
+        self.entries = corpus.entries()
+        self.by_law = {}
+        for article_id, (law_file, article) in enumerate(self.entries):
+            nums = self.by_law.setdefault(normalize(law_file.law), {})
+            nums.setdefault(normalize_article_num(article.num), []).append(article_id)
+
+    def resolve_laws(self, law_text):
+        """القوانين المقصودة باسم مكتوب: الاسم نفسه، أو ما يحتويه ("المدني")، أو ما يحتوي عليه."""
+        if not law_text:
+            return list(self.by_law)
+        wanted = normalize(law_text)
+        if wanted in self.by_law:
+            return [wanted]
+        return [law for law in self.by_law if wanted in law or law in wanted]
+
+    def find(self, num, law_text="", folder=None):
+        article_ids = []
+        for law in self.resolve_laws(law_text):
+            article_ids.extend(self.by_law[law].get(num, ()))
+        if folder is not None:
+            article_ids = [i for i in article_ids if self.entries[i][0].folder == folder]
+        return sorted(article_ids)
+
+    def neighbours(self, article_id):
+        """المادة السابقة والتالية في نفس ملف القانون (أو None عند الطرفين)."""
+        path = self.entries[article_id][0].path
+        previous_id = article_id - 1 if article_id > 0 and self.entries[article_id - 1][0].path == path else None
+        next_id = article_id + 1
+        if next_id >= len(self.entries) or self.entries[next_id][0].path != path:
+            next_id = None
+        return previous_id, next_id
+
+
+def get_article_lookup(corpus):
+    return corpus.derived("lookup", ArticleLookup)
+
+
+def lookup_reference(corpus, text, folder=None):
+    """أرقام المواد المقصودة بإشارة مثل "المادة 312 من القانون المدني".
+
+    تعيد None إن لم يكن النص إشارة، أو لم تطابق أي مادة (اسم قانون غير معروف مثل "المادة 5 من
+    هذا القانون" أو "مادة 12 عقد")، فيُبحث عن النص كالمعتاد.
+    """
+    reference = parse_article_reference(text)
+    if reference is None:
+        return None
+    num, law_text = reference
+    return get_article_lookup(corpus).find(num, law_text, folder) or None
@@ -0,0 +1,198 @@
+"""ملف المكتبة الثنائي المشترك: نصوص UTF-8 متتالية مع جداول مواضع ثابتة العرض، يُفتح بـ mmap.
+
+تفتح كل عملية من عمليات التطبيق الملف نفسه فتتشارك صفحات ذاكرة النظام بدل أن تحمل كل
+عملية نسختها من المواد، ولا تحتاج العملية الجديدة إلى تحليل أو فك أي ملف قبل أن تبدأ.
+
+البنية (little-endian):
+    الترويسة     MAGIC، رقم الصيغة، نسخة المكتبة (16 حرفًا)، عدد القوانين والمواد والنصوص والمواضع
+    القوانين     لكل قانون 5 × uint64: المجلد، المسار، الاسم (أرقام نصوص)، أول مادة، عدد المواد
+    المواد       لكل مادة 6 × uint64: رقم المادة (رقم نص)، أول فقرة (رقم نص)، عدد الفقرات،
+                 النص الموحد (رقم نص)، أول موضع وعدد المواضع في جدول المواضع (0 للخريطة المتطابقة)
+    النصوص       لكل نص 2 × uint64: الموضع والطول بالبايت داخل الكتلة
+    المواضع      خرائط مواضع النصوص الموحدة متتالية، uint32 لكل موضع
+    الكتلة       النصوص بترميز UTF-8 متتالية
+"""
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Sequence
+
+from arabic_text import NormalizedText
+
+MAGIC = b"LAWC"
+MMAP_FORMAT_VERSION = 2 # 2: النصوص الموحدة وخرائط مواضعها
+_HEADER = struct.Struct("<4sI16sQQQQ")
+_LAW_FIELDS = 5
+_ARTICLE_FIELDS = 6
+_STRING_FIELDS = 2
+
+
+def write_corpus_file(path, version, law_files):
+    """كتابة الملف بشكل ذري.
+
+    law_files: (المجلد، المسار، الاسم، [(رقم المادة، الفقرات، النص الموحد، خريطة المواضع أو None)]).
+    """
+    strings = []
+    laws = array("Q")
+    articles = array("Q")
+    offsets = array("I")
+
+    def add(text):
+        strings.append(text.encode("utf-8"))
+        return len(strings) - 1
+
+    for folder, law_path, law, law_articles in law_files:
+        laws.extend((add(folder), add(law_path), add(law), len(articles) // _ARTICLE_FIELDS, len(law_articles)))
+        for num, paragraphs, normalized_text, normalized_offsets in law_articles:
+            num_ref = add(num)
+            first = len(strings)
+            for paragraph in paragraphs:
+                add(paragraph)
+            offsets_start = len(offsets)
+            if normalized_offsets is not None:
+                offsets.extend(normalized_offsets)
+            articles.extend((num_ref, first, len(paragraphs), add(normalized_text),
+                             offsets_start, len(offsets) - offsets_start))
+
+    refs = array("Q")
+    offset = 0
+    for data in strings:
+        refs.extend((offset, len(data)))
+        offset += len(data)
+    if sys.byteorder != "little":
+        for table in (laws, articles, refs, offsets):
+            table.byteswap()
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, MMAP_FORMAT_VERSION, version.encode("ascii")[:16].ljust(16),
+                                 len(laws) // _LAW_FIELDS, len(articles) // _ARTICLE_FIELDS, len(strings), len(offsets)))
+            f.write(laws.tobytes())
+            f.write(articles.tobytes())
+            f.write(refs.tobytes())
+            f.write(offsets.tobytes())
+            for data in strings:
+                f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class MappedParagraphs(Sequence):
+    """فقرات مادة واحدة كعرض على الملف المشترك؛ كل فقرة تُفك عند طلبها فقط."""
+
+    __slots__ = ("_store", "_first", "_count")
+
+    def __init__(self, store, first, count):
+        self._store = store
+        self._first = first
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self[i] for i in range(*index.indices(self._count)))
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return self._store.string(self._first + index)
+
+    def __iter__(self):
+        for i in range(self._first, self._first + self._count):
+            yield self._store.string(i)
+
+    def __eq__(self, other):
+        return isinstance(other, Sequence) and tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return f"MappedParagraphs({tuple(self)!r})"
+
+
+class MappedNormalizedTexts(Sequence):
+    """النصوص الموحدة لكل المواد بترتيب الملف كعرض عليه، بدل حسابها في كل عملية."""
+
+    __slots__ = ("_store",)
+
+    def __init__(self, store):
+        self._store = store
+
+    def __len__(self):
+        return self._store.article_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self._store.normalized(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._store.normalized(i)
+
+
+class MappedCorpusFile:
+    """قراءة الملف دون نسخ: الجداول عروض memoryview على mmap، والنصوص تُفك عند الطلب."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, fmt, version, law_count, article_count, string_count, offset_count = _HEADER.unpack_from(view)
+        # الجداول تُقرأ بترتيب بايتات الجهاز مباشرة، فلا تُفتح على جهاز big-endian
+        if magic != MAGIC or fmt != MMAP_FORMAT_VERSION or sys.byteorder != "little":
+            raise ValueError("صيغة ملف المكتبة غير مدعومة")
+        self.version = version.rstrip(b" ").decode("ascii")
+        offset = _HEADER.size
+        tables = []
+        for count, fields in ((law_count, _LAW_FIELDS), (article_count, _ARTICLE_FIELDS), (string_count, _STRING_FIELDS)):
+            size = count * fields * 8
+            tables.append(view[offset:offset + size].cast("Q"))
+            offset += size
+        self._laws, self._articles, self._refs = tables
+        self._offsets = view[offset:offset + offset_count * 4].cast("I")
+        self._blob = view[offset + offset_count * 4:]
+        self.law_count = law_count
+        self.article_count = article_count
+
+    def string(self, index):
+        start = self._refs[2 * index]
+        return str(self._blob[start:start + self._refs[2 * index + 1]], "utf-8")
+
+    def normalized(self, article):
+        """النص الموحد للمادة رقم article، وخريطة مواضعه كعرض memoryview على الملف (أو None)."""
+        fields = self._articles[article * _ARTICLE_FIELDS + 3:(article + 1) * _ARTICLE_FIELDS]
+        text_ref, offsets_start, offsets_count = fields
+        offsets = self._offsets[offsets_start:offsets_start + offsets_count] if offsets_count else None
+        return NormalizedText(self.string(text_ref), offsets)
+
+    def normalized_texts(self):
+        return MappedNormalizedTexts(self)
+
+    def law_paths(self):
+        return [self.string(self._laws[i * _LAW_FIELDS + 1]) for i in range(self.law_count)]
+
+    def iter_laws(self):
+        """(المجلد، المسار، الاسم، [(رقم المادة، الفقرات كعرض MappedParagraphs)]) لكل قانون."""
+        laws, articles = self._laws, self._articles
+        for i in range(self.law_count):
+            folder, law_path, law, first_article, count = laws[i * _LAW_FIELDS:(i + 1) * _LAW_FIELDS]
+            law_articles = []
+            for a in range(first_article, first_article + count):
+                num_ref, first_paragraph, paragraph_count = articles[a * _ARTICLE_FIELDS:a * _ARTICLE_FIELDS + 3]
+                law_articles.append((self.string(num_ref), MappedParagraphs(self, first_paragraph, paragraph_count)))
+            yield self.string(folder), self.string(law_path), self.string(law), law_articles
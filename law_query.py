@@ -0,0 +1,386 @@
+"""لغة الاستعلام المتقدمة في مربع الكلمات المفتاحية، مع الفهرس الموضعي الذي تُقيَّم عليه.
+
+الصيغة:
+    كلمة1 & كلمة2      يجب أن تحتوي المادة على الكلمتين (وكذلك AND، أو المسافة داخل استعلام متقدم)
+    كلمة1 | كلمة2      إحدى الكلمتين (وكذلك OR أو الفاصلة)
+    -كلمة              استبعاد المواد التي تحتوي على الكلمة (وكذلك ! أو NOT)؛ يلزم معها كلمة مطلوبة
+    "عبارة كاملة"      كلمات متتالية بنفس الترتيب
+    كلمة1 ~5 كلمة2     الكلمتان على بعد 5 كلمات أو أقل
+    ( ... )            تجميع
+
+كل كلمة في الاستعلام تطابق أي كلمة في النص تحتويها، فتبقى السوابق مثل "وال" و"بال" مدعومة.
+المطابقة على النص الموحد (دون حركات وبصور حروف موحدة) ثم تُعاد المواضع إلى النص الأصلي.
+"""
+import re
+from array import array
+from heapq import merge
+
+from arabic_text import get_normalized_texts, normalize, to_original_spans
+from law_highlight import merge_spans
+from law_trigram import ngrams
+
+# يطبق على النص الموحد، وقد حُذفت منه الحركات فلا تنقسم الكلمة المشكولة
+TOKEN_PATTERN = re.compile(r"\w+")
+
+_QUERY_TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+        (?P<phrase>"[^"]*")
+      | (?P<near>~\d+)
+      | (?P<op>[&|(),،!-])
+      | (?P<word>[^\s&|(),،"~!][^\s&|(),،"~]*)
+    )''', re.VERBOSE)
+_OPERATOR_WORDS = {"AND": "&", "OR": "|", "NOT": "!"}
+_ADVANCED_PATTERN = re.compile(r'["&|~!]|(?:^|[\s(])-\S|\b(?:AND|OR|NOT)\b')
+
+
+class QuerySyntaxError(ValueError):
+    """خطأ في صيغة الاستعلام المتقدم."""
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(normalize(text))
+
+
+def is_advanced_query(text):
+    """هل يستخدم النص عوامل لغة الاستعلام؟ وإلا يبقى البحث القديم (كلمات مفصولة بفواصل)."""
+    return bool(_ADVANCED_PATTERN.search(text))
+
+
+def _lex(text):
+    pos = 0
+    tokens = []
+    text = text.rstrip()
+    while pos < len(text):
+        m = _QUERY_TOKEN_PATTERN.match(text, pos)
+        if not m or m.end() == pos:
+            raise QuerySyntaxError(f"رمز غير متوقع في الاستعلام: {text[pos:pos + 10]}")
+        pos = m.end()
+        if m.group("phrase") is not None:
+            tokens.append(("phrase", m.group("phrase")[1:-1]))
+        elif m.group("near") is not None:
+            tokens.append(("near", int(m.group("near")[1:])))
+        elif m.group("op") is not None:
+            op = m.group("op")
+            tokens.append(("op", {",": "|", "،": "|", "-": "!"}.get(op, op)))
+        else:
+            word = m.group("word")
+            if word in _OPERATOR_WORDS:
+                tokens.append(("op", _OPERATOR_WORDS[word]))
+            else:
+                tokens.append(("word", word))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QuerySyntaxError("الاستعلام فارغ.")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise QuerySyntaxError("قوس إغلاق زائد في الاستعلام.")
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == ("op", "|"):
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else ("or", tuple(children))
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while True:
+            token = self.peek()
+            if token == ("op", "&"):
+                self.take()
+            elif token is None or token in (("op", "|"), ("op", ")")):
+                break
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else ("and", tuple(children))
+
+    def parse_not(self):
+        if self.peek() == ("op", "!"):
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_near()
+
+    def parse_near(self):
+        node = self.parse_primary()
+        while self.peek() and self.peek()[0] == "near":
+            distance = self.take()[1]
+            right = self.parse_primary()
+            if node[0] != "seq" or right[0] != "seq":
+                raise QuerySyntaxError("عامل القرب ~ يعمل بين كلمات أو عبارات فقط.")
+            node = ("near", node, right, distance)
+        return node
+
+    def parse_primary(self):
+        token = self.take()
+        if token is None:
+            raise QuerySyntaxError("الاستعلام ينتهي بعامل دون كلمة بعده.")
+        kind, value = token
+        if kind in ("word", "phrase"):
+            words = tuple(tokenize(value))
+            if not words:
+                raise QuerySyntaxError(f"لا توجد كلمات صالحة في: {value}")
+            return ("seq", words)
+        if token == ("op", "("):
+            node = self.parse_or()
+            if self.take() != ("op", ")"):
+                raise QuerySyntaxError("قوس غير مغلق في الاستعلام.")
+            return node
+        raise QuerySyntaxError("عامل في غير موضعه في الاستعلام.")
+
+
+def _has_positive(node):
+    """هل تضمن العقدة كلمة مطابقة في كل مادة تعيدها؟ الاستبعاد وحده لا يترك ما يُعرض أو يُظلل."""
+    kind = node[0]
+    if kind == "not":
+        return False
+    if kind == "or":
+        return all(_has_positive(child) for child in node[1])
+    if kind == "and":
+        return any(_has_positive(child) for child in node[1])
+    return True
+
+
+def parse_query(text):
+    """تحويل نص الاستعلام إلى شجرة من الصفوف (and / or / not / near / seq)."""
+    query = _Parser(_lex(text)).parse()
+    if not _has_positive(query):
+        raise QuerySyntaxError("الاستبعاد وحده لا يكفي: أضف كلمة يجب أن تحتويها المواد، مثل: عقد -البيع")
+    return query
+
+
+def intersect_sorted(a, b):
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            result.append(a[i])
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def union_sorted(a, b):
+    result = []
+    for x in merge(a, b):
+        if not result or result[-1] != x:
+            result.append(x)
+    return result
+
+
+def difference_sorted(a, b):
+    result = []
+    j = 0
+    for x in a:
+        while j < len(b) and b[j] < x:
+            j += 1
+        if j >= len(b) or b[j] != x:
+            result.append(x)
+    return result
+
+
+class PositionalIndex:
+    """فهرس موضعي: كل كلمة -> (أرقام المواد مرتبة، ومواضع الكلمة في كل مادة).
+
+    يحتفظ أيضًا ببداية ونهاية كل كلمة داخل النص الموحد للمادة، لتحويل المطابقات إلى
+    مواضع أحرف تذهب مباشرة إلى التظليل.
+    """
+
+    def __init__(self, corpus):
+        self.entries = corpus.entries()
+        self.normalized = get_normalized_texts(corpus)
+        self.token_starts = []
+        self.token_ends = []
+        postings = {}
+        for article_id, normalized in enumerate(self.normalized):
+            starts = array("I")
+            ends = array("I")
+            for position, m in enumerate(TOKEN_PATTERN.finditer(normalized.text)):
+                starts.append(m.start())
+                ends.append(m.end())
+                token = m.group()
+                token_postings = postings.get(token)
+                if token_postings is None:
+                    token_postings = postings[token] = {}
+                positions = token_postings.get(article_id)
+                if positions is None:
+                    positions = token_postings[article_id] = array("I")
+                positions.append(position)
+            self.token_starts.append(starts)
+            self.token_ends.append(ends)
+        self.postings = postings
+        # فهرس ثلاثيات على المفردات لإيجاد الكلمات التي تحتوي على كلمة الاستعلام بسرعة
+        vocab_grams = {}
+        for token in postings:
+            for gram in ngrams(token):
+                vocab_grams.setdefault(gram, set()).add(token)
+        self.vocab_grams = vocab_grams
+
+    def matching_tokens(self, word):
+        """كلمات النص التي تحتوي على كلمة الاستعلام."""
+        grams = ngrams(word)
+        if not grams:
+            return [token for token in self.postings if word in token]
+        candidates = None
+        for gram in grams:
+            tokens = self.vocab_grams.get(gram)
+            if not tokens:
+                return []
+            candidates = set(tokens) if candidates is None else candidates & tokens
+        return [token for token in candidates if word in token]
+
+    def word_positions(self, word):
+        """رقم المادة -> مواضع الكلمات (مرتبة) التي تحتوي على كلمة الاستعلام."""
+        merged = {}
+        for token in self.matching_tokens(word):
+            for article_id, positions in self.postings[token].items():
+                merged.setdefault(article_id, []).append(positions)
+        return {
+            article_id: lists[0] if len(lists) == 1 else array("I", sorted(merge(*lists)))
+            for article_id, lists in merged.items()
+        }
+
+    def char_spans(self, article_id, token_spans):
+        """تحويل مواضع الكلمات (بداية، نهاية شاملة) إلى مواضع أحرف في نص المادة الأصلي."""
+        starts = self.token_starts[article_id]
+        ends = self.token_ends[article_id]
+        # مطابقات "أو" والقرب قد تتداخل (مثل "عقد البيع" | البيع) فتُدمج قبل التظليل
+        spans = merge_spans((starts[first], ends[last]) for first, last in token_spans)
+        return to_original_spans(self.normalized[article_id], spans)
+
+
+class _Matches:
+    """نتيجة تقييم عقدة: أرقام المواد مرتبة، ومواضع المطابقة في كل مادة."""
+    __slots__ = ("ids", "spans")
+
+    def __init__(self, ids, spans):
+        self.ids = ids
+        self.spans = spans
+
+
+def _evaluate_seq(index, words, universe):
+    per_word = [index.word_positions(word) for word in words]
+    ids = intersect_sorted(sorted(per_word[0]), universe)
+    for positions in per_word[1:]:
+        ids = intersect_sorted(ids, sorted(positions))
+    spans = {}
+    matched = []
+    for article_id in ids:
+        following = [set(positions[article_id]) for positions in per_word[1:]]
+        found = [
+            (start, start + len(words) - 1)
+            for start in per_word[0][article_id]
+            if all(start + offset + 1 in positions for offset, positions in enumerate(following))
+        ]
+        if found:
+            matched.append(article_id)
+            spans[article_id] = found
+    return _Matches(matched, spans)
+
+
+def _evaluate_near(left, right, distance):
+    spans = {}
+    matched = []
+    for article_id in intersect_sorted(left.ids, right.ids):
+        found = []
+        for a in left.spans[article_id]:
+            for b in right.spans[article_id]:
+                if a == b:
+                    # نفس الموضع من الطرفين (مثل البيع ~2 البيع): القرب يحتاج موضعين مختلفين
+                    continue
+                gap = b[0] - a[1] if b[0] >= a[0] else a[0] - b[1]
+                if gap <= distance:
+                    found.extend((a, b))
+        if found:
+            matched.append(article_id)
+            spans[article_id] = found
+    return _Matches(matched, spans)
+
+
+def _merge_spans(ids, *sources):
+    spans = {}
+    for article_id in ids:
+        collected = []
+        for source in sources:
+            collected.extend(source.spans.get(article_id, ()))
+        if collected:
+            spans[article_id] = collected
+    return spans
+
+
+def _evaluate(index, node, universe):
+    kind = node[0]
+    if kind == "seq":
+        return _evaluate_seq(index, node[1], universe)
+    if kind == "near":
+        return _evaluate_near(_evaluate(index, node[1], universe), _evaluate(index, node[2], universe), node[3])
+    if kind == "not":
+        return _Matches(difference_sorted(universe, _evaluate(index, node[1], universe).ids), {})
+    if kind == "or":
+        results = [_evaluate(index, child, universe) for child in node[1]]
+        ids = []
+        for result in results:
+            ids = union_sorted(ids, result.ids)
+        return _Matches(ids, _merge_spans(ids, *results))
+    # and: تقاطع الشروط الموجبة أولًا ثم طرح المستبعدة
+    positives = [_evaluate(index, child, universe) for child in node[1] if child[0] != "not"]
+    negatives = [_evaluate(index, child[1], universe) for child in node[1] if child[0] == "not"]
+    ids = universe
+    for result in sorted(positives, key=lambda r: len(r.ids)):
+        ids = intersect_sorted(ids, result.ids)
+    for result in negatives:
+        ids = difference_sorted(ids, result.ids)
+    return _Matches(ids, _merge_spans(ids, *positives))
+
+
+def get_positional_index(corpus):
+    return corpus.derived("positional", PositionalIndex)
+
+
+def match_query(corpus, query, law_files=None, article_ids=None):
+    """أرقام المواد المطابقة (مرتبة بترتيب الملفات) ومواضع الكلمات المطابقة في كل مادة.
+
+    لا تُحوَّل المواضع إلى مواضع أحرف هنا؛ PositionalIndex.char_spans تحولها عند الحاجة، فيمكن
+    حساب أرقام المواد للاستعلام كله ثم مواضع الأحرف قانونًا بعد قانون.
+    """
+    index = get_positional_index(corpus)
+    if law_files is None:
+        universe = list(range(len(index.entries)))
+    else:
+        allowed = {lf.path for lf in law_files}
+        universe = [i for i, (lf, _) in enumerate(index.entries) if lf.path in allowed]
+    if article_ids is not None:
+        universe = intersect_sorted(universe, sorted(article_ids))
+    result = _evaluate(index, query, universe)
+    if law_files is not None or article_ids is not None:
+        return _Matches(intersect_sorted(result.ids, universe), result.spans)
+    return result
+
+
+def run_query(corpus, query, law_files=None, article_ids=None):
+    """تقييم شجرة الاستعلام على المكتبة، أو على مواد مرشحة فقط (article_ids) عند تضييق بحث سابق.
+
+    تعيد قائمة (رقم المادة، مواضع الأحرف المطابقة في نص المادة الأصلي) بترتيب الملفات.
+    """
+    index = get_positional_index(corpus)
+    matches = match_query(corpus, query, law_files, article_ids)
+    return [(article_id, index.char_spans(article_id, matches.spans.get(article_id, ()))) for article_id in matches.ids]
@@ -0,0 +1,276 @@
+import logging
+from bisect import bisect_left
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+
+import law_fts
+import metrics
+from arabic_text import get_normalized_texts, normalize, to_original_spans
+from law_highlight import get_matcher
+from law_query import get_positional_index, is_advanced_query, match_query, parse_query, run_query, tokenize
+from law_trigram import get_trigram_index
+from result_cache import ResultCache
+
+# عدد عمليات البحث التي تعمل في الخلفية في نفس الوقت (لكل العملية، مشتركة بين الجلسات)
+SEARCH_WORKERS = 4
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="law-search")
+
+# نتائج البحث المكتملة مشتركة بين الجلسات؛ الحجم يُقاس بعدد النتائج المخزنة
+SEARCH_CACHE_MAX_ENTRIES = 256
+SEARCH_CACHE_MAX_HITS = 500_000
+SEARCH_CACHE_TTL = 60 * 60
+search_cache = ResultCache(SEARCH_CACHE_MAX_ENTRIES, max_size=SEARCH_CACHE_MAX_HITS, ttl=SEARCH_CACHE_TTL)
+metrics.register_cache("search", search_cache)
+
+_prepared_version = None
+_prepare_lock = threading.Lock()
+
+
+def prepare_indexes(corpus):
+    """مزامنة الفهارس مع نسخة المكتبة مرة واحدة لكل نسخة داخل العملية."""
+    global _prepared_version
+    if _prepared_version == corpus.version:
+        return
+    with _prepare_lock:
+        if _prepared_version != corpus.version:
+            law_fts.sync_index(corpus)
+            # المفاتيح تتضمن نسخة المكتبة، فنتائج النسخة السابقة لن تُطلب مجددًا
+            search_cache.clear()
+            _prepared_version = corpus.version
+
+
+def iter_law_files(corpus, folder=None, law=None):
+    """ملفات القوانين ضمن نطاق البحث (مجلد معين و/أو قانون معين)."""
+    for law_file in corpus.iter_law_files(folder):
+        if law is None or law_file.law == law:
+            yield law_file
+
+
+def search_articles(corpus, keywords, folder=None, law=None):
+    """البحث عن المواد التي تحتوي على أي من الكلمات المفتاحية.
+
+    يُستخدم فهرس FTS5 مرتبًا حسب الصلة (bm25) عندما تسمح الكلمات بذلك، وإلا (كلمات أقصر
+    من 3 أحرف أو فهرس لا يطابق النسخة الحالية) يُستخدم فهرس الثلاثيات في الذاكرة بترتيب الملفات.
+    تعيد أرقام المواد (مواضعها في corpus.entries()).
+    """
+    law_files = list(iter_law_files(corpus, folder, law))
+    paths = None if folder is None and law is None else [lf.path for lf in law_files]
+    hits = law_fts.search_index(corpus, keywords, paths)
+    if hits is None:
+        return get_trigram_index(corpus).search(keywords, None if paths is None else law_files)
+    return [corpus.article_id(path, ordinal) for path, ordinal, _ in hits]
+
+
+def parse_keywords(query_text):
+    """الكلمات المفصولة بفواصل في البحث العادي."""
+    return [k.strip() for k in query_text.split(",") if k.strip()]
+
+
+def search_cache_key(corpus, query_text, folder=None, law=None):
+    """مفتاح الذاكرة المؤقتة: الكلمات الموحدة مرتبة دون تكرار (أو شجرة الاستعلام المتقدم)،
+    مع النطاق ونسخة المكتبة، فيتطابق مفتاح "البيع, عقد" و"عقد ,البيع".
+    """
+    if is_advanced_query(query_text):
+        query = parse_query(query_text)
+    else:
+        query = tuple(sorted({normalize(kw) for kw in parse_keywords(query_text)}))
+    return (query, folder, law, corpus.version)
+
+
+def iter_search_hits(corpus, query_text, folder=None, law=None, cancel_event=None):
+    """تنفيذ البحث قانونًا بعد قانون.
+
+    تعطي (ملف القانون، [(رقم المادة، مواضع المطابقة في النص الأصلي، الترتيب)]) لكل قانون في
+    النطاق (والقائمة فارغة إن لم توجد نتائج)، وتتوقف فور ضبط cancel_event. ما يُحسب للاستعلام
+    كله مرة واحدة رخيص (أرقام مواد الاستعلام المتقدم، أو مرشحو فهرس الثلاثيات)، أما التحقق
+    ومواضع المطابقة فتُحسب لكل قانون داخل الحلقة، فيصل أول قانون قبل اكتمال البحث.
+    الترتيب درجة bm25 إن استُخدم فهرس FTS5 (محسوبة من إحصاءات الفهرس كله فتصلح للمقارنة بين
+    القوانين)، وإلا رقم المادة؛ تُدمج به نتائج القوانين بعد اكتمالها (rank_hits).
+    """
+    law_files = list(iter_law_files(corpus, folder, law))
+    if is_advanced_query(query_text):
+        index = get_positional_index(corpus)
+        matches = match_query(corpus, parse_query(query_text), law_files if folder or law else None)
+        by_path = {}
+        entries = corpus.entries()
+        for article_id in matches.ids:
+            by_path.setdefault(entries[article_id][0].path, []).append(article_id)
+        for law_file in law_files:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            yield law_file, [
+                (article_id, index.char_spans(article_id, matches.spans.get(article_id, ())), article_id)
+                for article_id in by_path.get(law_file.path, ())
+            ]
+        return
+
+    kw_list = parse_keywords(query_text)
+    lowered = [normalize(kw) for kw in kw_list]
+    matcher = get_matcher(lowered)
+    normalized_texts = get_normalized_texts(corpus)
+    use_index = law_fts.can_use_index(kw_list)
+    trigram = candidate_ids = None
+    for law_file in law_files:
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        ranked = law_fts.search_index(corpus, kw_list, [law_file.path]) if use_index else None
+        if ranked is None:
+            # فهرس FTS5 لا يصلح للكلمات أو لا يطابق النسخة: مرشحو الثلاثيات يُحسبون مرة واحدة
+            use_index = False
+            if trigram is None:
+                trigram = get_trigram_index(corpus)
+                candidate_ids = trigram.candidate_ids(lowered)
+            start = corpus.article_id(law_file.path, 0)
+            end = start + len(law_file.articles)
+            if candidate_ids is None:
+                ids = range(start, end)
+            else:
+                ids = candidate_ids[bisect_left(candidate_ids, start):bisect_left(candidate_ids, end)]
+            ranked = [(article_id, article_id) for article_id in trigram.verify(ids, lowered)]
+        else:
+            ranked = [(corpus.article_id(path, ordinal), score) for path, ordinal, score in ranked]
+        hits = []
+        for article_id, rank in ranked:
+            normalized = normalized_texts[article_id]
+            hits.append((article_id, to_original_spans(normalized, matcher.spans(normalized.text)), rank))
+        yield law_file, hits
+
+
+def rank_hits(hits):
+    """دمج نتائج القوانين (SearchHit) بترتيب الصلة على مستوى الاستعلام كله."""
+    return sorted(hits, key=attrgetter("rank"))
+
+
+def _positional_tree(query_text):
+    """شجرة استعلام تطابق نفس مواد البحث على الفهرس الموضعي، أو None.
+
+    البحث العادي يكافئ "أو" بين كلماته فقط إذا كانت كل كلمة مفردة واحدة بعد التوحيد؛
+    فالكلمة عندها تطابق جزءًا من كلمة في النص، وهو ما يفعله الفهرس الموضعي.
+    """
+    if is_advanced_query(query_text):
+        return parse_query(query_text)
+    seqs = []
+    for kw in parse_keywords(query_text):
+        words = tokenize(kw)
+        if words != [normalize(kw)]:
+            return None
+        seqs.append(("seq", tuple(words)))
+    if not seqs:
+        return None
+    return seqs[0] if len(seqs) == 1 else ("or", tuple(seqs))
+
+
+def _and_terms(tree):
+    return frozenset(tree[1]) if tree[0] == "and" else frozenset([tree])
+
+
+@metrics.timed("search.refine")
+def refine_search(corpus, query_text, folder, law, previous, previous_hits):
+    """تقييم بحث جديد على نتائج بحث سابق مكتمل بدل المكتبة كلها، إن كان تضييقًا له.
+
+    previous هو (نص الاستعلام، المجلد، القانون) للبحث السابق، ونتائجه previous_hits من نفس
+    نسخة المكتبة. التضييق: نفس الاستعلام في مجلد أو قانون ضمن النطاق السابق، أو استعلام
+    يضيف شروط "و" إلى شروط الاستعلام السابق. تعيد قائمة SearchHit، أو None للبحث الكامل.
+    """
+    previous_text, previous_folder, previous_law = previous
+    if previous_folder is not None and previous_folder != folder:
+        return None
+    if previous_law is not None and previous_law != law:
+        return None
+    entries = corpus.entries()
+    in_scope = [
+        hit for hit in previous_hits
+        if (folder is None or entries[hit.article_id][0].folder == folder)
+        and (law is None or entries[hit.article_id][0].law == law)
+    ]
+    if search_cache_key(corpus, query_text)[0] == search_cache_key(corpus, previous_text)[0]:
+        return in_scope
+
+    new_tree = _positional_tree(query_text)
+    old_tree = _positional_tree(previous_text)
+    if new_tree is None or old_tree is None or not _and_terms(old_tree) < _and_terms(new_tree):
+        return None
+    # كل مادة تطابق الاستعلام الجديد تطابق شروط السابق، فتكفي نتائجه مرشحين
+    candidates = [hit.article_id for hit in in_scope]
+    return [SearchHit(article_id, spans) for article_id, spans in run_query(corpus, new_tree, article_ids=candidates)]
+
+
+class SearchHit:
+    """نتيجة بحث مضغوطة: رقم المادة في corpus.entries() ومواضع المطابقة فقط.
+
+    لا تُنسخ نصوص المواد إلى النتيجة؛ النص والسياق والتظليل تُشتق من المكتبة المشتركة
+    عند العرض، فتبقى نتائج الجلسة بالكيلوبايتات.
+    """
+
+    __slots__ = ("article_id", "spans", "rank")
+
+    def __init__(self, article_id, spans, rank=0):
+        self.article_id = article_id
+        # مفتاح الترتيب على مستوى الاستعلام كله (درجة bm25 أو رقم المادة)؛ النتائج تصل قانونًا بعد قانون ثم تُرتب به
+        self.rank = rank
+        # المواضع مسطحة: بداية1، نهاية1، بداية2، نهاية2، ...
+        self.spans = array("I", [pos for span in spans for pos in span])
+
+    def span_pairs(self):
+        return list(zip(self.spans[::2], self.spans[1::2]))
+
+
+class SearchJob:
+    """بحث يعمل في خيط خلفي ويجمع النتائج قانونًا بعد قانون، ثم يرتبها بالصلة عند انتهائه.
+
+    يبقى الكائن في حالة الجلسة بين عمليات إعادة التشغيل، فتستأنف الواجهة عرض التقدم
+    من حيث وصلت، ويمكن إلغاؤه فيتوقف الخيط عند أول فحص بدل إكمال البحث.
+    البحث المكتمل (غير الملغى) يُخزن في search_cache تحت cache_key.
+    """
+
+    def __init__(self, producer, total, cache_key=None):
+        self.total = total
+        self.cache_key = cache_key
+        self.results = []
+        self.laws_done = 0
+        self.error = None
+        self.finished = False
+        self.cancel_event = threading.Event()
+        self._changed = threading.Condition()
+        self._future = _search_executor.submit(self._run, producer)
+
+    def _run(self, producer):
+        start = time.perf_counter()
+        try:
+            for law_results in producer(self.cancel_event):
+                with self._changed:
+                    self.results.extend(law_results)
+                    self.laws_done += 1
+                    self._changed.notify_all()
+            # العرض المباشر يقرأ القائمة أثناء البحث، فتُستبدل بنسخة مرتبة بدل ترتيبها في مكانها
+            ranked = rank_hits(self.results)
+            with self._changed:
+                self.results = ranked
+            if self.cache_key is not None and not self.cancelled:
+                search_cache.put(self.cache_key, tuple(self.results))
+            if not self.cancelled:
+                metrics.observe("search.job", time.perf_counter() - start)
+        except Exception as e:
+            self.error = e
+            metrics.log_event("search_failed", logging.ERROR, error=repr(e))
+        finally:
+            with self._changed:
+                self.finished = True
+                self._changed.notify_all()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def wait(self, seen, timeout=0.2):
+        """انتظار نتائج جديدة بعد أول seen نتيجة أو انتهاء البحث؛ تعيد عدد النتائج الحالي."""
+        with self._changed:
+            if len(self.results) == seen and not self.finished:
+                self._changed.wait(timeout)
+            return len(self.results)
@@ -0,0 +1,199 @@
+"""المواد ذات الصلة: متجهات TF-IDF للمواد وتشابه جيب التمام بينها.
+
+المصفوفة (المواد × الكلمات) مخزنة بصيغة CSR في مصفوفات NumPy ومطبّعة L2، فيصبح التشابه
+جداءً داخليًا. نسخة مرتبة حسب الكلمات من نفس المصفوفة تجعل حساب التشابه مع كل المواد
+ضرب مصفوفة في متجه متفرق (bincount واحد)، والجيران قد يُحسبون مسبقًا عند الفهرسة.
+"""
+import io
+import os
+
+import numpy as np
+
+from arabic_text import get_normalized_texts
+from law_corpus import CACHE_DIR
+from law_query import TOKEN_PATTERN
+
+SIMILARITY_FORMAT_VERSION = 1 # يجب زيادته عند تغيير طريقة بناء المصفوفة
+MIN_TERM_LENGTH = 2
+# الكلمات الموجودة في أكثر من هذا الجزء من المواد لا تميز بينها
+MAX_DOC_FREQUENCY = 0.5
+NEIGHBOURS_K = 10
+_NEIGHBOUR_ARRAYS = ("same_law", "same_scores", "other_laws", "other_scores")
+
+
+def similarity_file_for(corpus):
+    return os.path.join(CACHE_DIR, f"similar-{corpus.version}.npz")
+
+
+def _term_counts(corpus):
+    vocab = {}
+    rows = []
+    for normalized in get_normalized_texts(corpus):
+        counts = {}
+        for token in TOKEN_PATTERN.findall(normalized.text):
+            if len(token) >= MIN_TERM_LENGTH and not token.isdigit():
+                term_id = vocab.setdefault(token, len(vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+        rows.append(counts)
+    return rows, len(vocab)
+
+
+def build_matrix(corpus):
+    """مصفوفة TF-IDF (indptr، indices، data) بصيغة CSR، كل صف مطبّع L2."""
+    rows, vocab_size = _term_counts(corpus)
+    n = len(rows)
+    lengths = np.fromiter((len(counts) for counts in rows), np.int64, n)
+    total = int(lengths.sum())
+    indices = np.fromiter((t for counts in rows for t in counts), np.int32, total)
+    counts = np.fromiter((c for counts in rows for c in counts.values()), np.float32, total)
+    row_ids = np.repeat(np.arange(n, dtype=np.int32), lengths)
+
+    df = np.bincount(indices, minlength=vocab_size)
+    idf = np.log(max(n, 1) / np.maximum(df, 1)).astype(np.float32)
+    useful = (df >= 2) & (df <= MAX_DOC_FREQUENCY * n)
+    keep = useful[indices]
+    indices, row_ids = indices[keep], row_ids[keep]
+    data = (1 + np.log(counts[keep])) * idf[indices]
+
+    norms = np.sqrt(np.bincount(row_ids, data * data, minlength=n)).astype(np.float32)
+    data /= norms[row_ids]
+    indptr = np.zeros(n + 1, np.int64)
+    np.cumsum(np.bincount(row_ids, minlength=n), out=indptr[1:])
+    return indptr, indices, data.astype(np.float32)
+
+
+class SimilarityIndex:
+    """التشابه بين المواد (بترتيب corpus.entries()) مع جيران محسوبين مسبقًا اختياريًا."""
+
+    def __init__(self, corpus, indptr, indices, data, neighbours=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        # (جيران نفس القانون، درجاتهم، جيران القوانين الأخرى، درجاتهم) كمصفوفات (المواد × k)
+        self.neighbours = neighbours
+        self.size = len(indptr) - 1
+        # نطاق ملف القانون لكل مادة، لفصل جيران نفس القانون عن القوانين الأخرى
+        starts = np.zeros(self.size, np.int64)
+        ends = np.zeros(self.size, np.int64)
+        offset = 0
+        for law_file in corpus.law_files:
+            count = len(law_file.articles)
+            starts[offset:offset + count] = offset
+            ends[offset:offset + count] = offset + count
+            offset += count
+        self.file_starts = starts
+        self.file_ends = ends
+        # نفس المصفوفة مرتبة حسب الكلمات (CSC)
+        order = np.argsort(indices, kind="stable")
+        row_ids = np.repeat(np.arange(self.size, dtype=np.int32), np.diff(indptr))
+        self.col_rows = row_ids[order]
+        self.col_data = data[order]
+        self.col_ptr = np.zeros(int(indices.max(initial=-1)) + 2, np.int64)
+        np.cumsum(np.bincount(indices, minlength=len(self.col_ptr) - 1), out=self.col_ptr[1:])
+
+    def scores(self, article_id):
+        """تشابه جيب التمام بين المادة وجميع المواد (ضرب المصفوفة في متجه المادة)."""
+        start, end = self.indptr[article_id], self.indptr[article_id + 1]
+        terms = self.indices[start:end]
+        weights = self.data[start:end]
+        col_starts = self.col_ptr[terms]
+        lengths = self.col_ptr[terms + 1] - col_starts
+        # مواضع جميع عناصر أعمدة كلمات المادة متتالية، دون حلقة على الكلمات
+        shifts = np.repeat(col_starts - (np.cumsum(lengths) - lengths), lengths)
+        positions = shifts + np.arange(int(lengths.sum()))
+        contributions = self.col_data[positions] * np.repeat(weights, lengths)
+        return np.bincount(self.col_rows[positions], contributions, minlength=self.size)
+
+    def _compute(self, article_id, k):
+        scores = self.scores(article_id)
+        scores[article_id] = 0
+        lo, hi = self.file_starts[article_id], self.file_ends[article_id]
+        same = _top_k(scores[lo:hi], k) + lo
+        same_scores = scores[same]
+        scores[lo:hi] = 0
+        other = _top_k(scores, k)
+        return same, same_scores, other, scores[other]
+
+    def related(self, article_id, k=5):
+        """(أقرب مواد نفس القانون، أقرب مواد القوانين الأخرى): قوائم (رقم المادة، التشابه)."""
+        if self.neighbours is not None and k <= self.neighbours[0].shape[1]:
+            same, same_scores, other, other_scores = (a[article_id][:k] for a in self.neighbours)
+            same_scores, other_scores = same_scores[same >= 0], other_scores[other >= 0]
+            same, other = same[same >= 0], other[other >= 0]
+        else:
+            same, same_scores, other, other_scores = self._compute(article_id, k)
+        return (
+            [(int(i), float(score)) for i, score in zip(same, same_scores)],
+            [(int(i), float(score)) for i, score in zip(other, other_scores)],
+        )
+
+    def precompute_neighbours(self, k=NEIGHBOURS_K):
+        """أقرب k مواد من نفس القانون ومن غيره لكل مادة مع درجات التشابه (-1 حيث لا يوجد جار)."""
+        same_law = np.full((self.size, k), -1, np.int32)
+        same_scores = np.zeros((self.size, k), np.float32)
+        other_laws = np.full((self.size, k), -1, np.int32)
+        other_scores = np.zeros((self.size, k), np.float32)
+        for article_id in range(self.size):
+            same, s_scores, other, o_scores = self._compute(article_id, k)
+            same_law[article_id, :len(same)] = same
+            same_scores[article_id, :len(same)] = s_scores
+            other_laws[article_id, :len(other)] = other
+            other_scores[article_id, :len(other)] = o_scores
+        self.neighbours = (same_law, same_scores, other_laws, other_scores)
+
+    def save(self, path):
+        arrays = {
+            "format": np.array([SIMILARITY_FORMAT_VERSION]),
+            "indptr": self.indptr, "indices": self.indices, "data": self.data,
+        }
+        if self.neighbours is not None:
+            arrays.update(zip(_NEIGHBOUR_ARRAYS, self.neighbours))
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(buffer.getvalue())
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _top_k(scores, k):
+    """مواضع أعلى k قيم موجبة مرتبة تنازليًا."""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return candidates[scores[candidates] > 0]
+
+
+def load_similarity_index(corpus):
+    try:
+        with np.load(similarity_file_for(corpus)) as saved:
+            if int(saved["format"][0]) != SIMILARITY_FORMAT_VERSION or len(saved["indptr"]) != corpus.article_count() + 1:
+                return None
+            neighbours = tuple(saved[name] for name in _NEIGHBOUR_ARRAYS) if _NEIGHBOUR_ARRAYS[0] in saved else None
+            return SimilarityIndex(corpus, saved["indptr"], saved["indices"], saved["data"], neighbours)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def build_similarity_index(corpus, neighbours=0):
+    """بناء المصفوفة (والجيران إن طُلب) وحفظها بجوار ذاكرة التحليل لنسخة المكتبة."""
+    index = SimilarityIndex(corpus, *build_matrix(corpus))
+    if neighbours:
+        index.precompute_neighbours(neighbours)
+    index.save(similarity_file_for(corpus))
+    return index
+
+
+def _load_or_build(corpus):
+    return load_similarity_index(corpus) or build_similarity_index(corpus)
+
+
+def get_similarity_index(corpus):
+    return corpus.derived("similarity", _load_or_build)
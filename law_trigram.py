@@ -0,0 +1,80 @@
+from array import array
+
+from arabic_text import get_normalized_texts, normalize
+
+# الكلمات الأقصر من طول الثلاثية لا يمكن تضييقها بالفهرس فتُفحص كل المواد
+NGRAM_SIZE = 3
+
+
+def ngrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class TrigramIndex:
+    """فهرس ثلاثيات في الذاكرة: كل ثلاثية -> أرقام المواد التي تحتويها (مرتبة تصاعديًا).
+
+    يستخدم لتضييق المواد المرشحة فقط؛ التحقق النهائي يبقى فحص "يحتوي على" نفسه على
+    النص الموحد، لذا تبقى النتائج مطابقة تمامًا للبحث الخطي.
+    """
+
+    def __init__(self, corpus):
+        self.entries = corpus.entries()
+        self.texts = [normalized.text for normalized in get_normalized_texts(corpus)]
+        postings = {}
+        for article_id, text in enumerate(self.texts):
+            for gram in ngrams(text):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array("I")
+                posting.append(article_id)
+        self.postings = postings
+
+    def candidates(self, keyword):
+        """أرقام المواد التي تحتوي على جميع ثلاثيات الكلمة، أو None إذا كانت الكلمة قصيرة."""
+        grams = ngrams(keyword)
+        if not grams:
+            return None
+        lists = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                return set()
+            lists.append(posting)
+        # البدء بأقصر قائمة يجعل التقاطع أرخص
+        lists.sort(key=len)
+        result = set(lists[0])
+        for posting in lists[1:]:
+            result.intersection_update(posting)
+            if not result:
+                break
+        return result
+
+    def candidate_ids(self, keywords):
+        """أرقام المواد المرشحة (مرتبة) لأي من الكلمات الموحدة، أو None إذا وجب فحص كل المواد."""
+        ids = set()
+        for kw in keywords:
+            found = self.candidates(kw)
+            if found is None:
+                return None
+            ids |= found
+        return sorted(ids)
+
+    def verify(self, article_ids, keywords):
+        """المواد من article_ids التي يحتوي نصها الموحد فعلًا على أي من الكلمات الموحدة."""
+        texts = self.texts
+        return [article_id for article_id in article_ids if any(kw in texts[article_id] for kw in keywords)]
+
+    def search(self, keywords, law_files=None):
+        """أرقام المواد التي تحتوي على أي من الكلمات، بترتيب الملفات كما في البحث الخطي."""
+        lowered = [normalize(kw) for kw in keywords]
+        candidate_ids = self.candidate_ids(lowered)
+        if candidate_ids is None:
+            candidate_ids = range(len(self.entries))
+        if law_files is not None:
+            allowed = {lf.path for lf in law_files}
+            candidate_ids = [i for i in candidate_ids if self.entries[i][0].path in allowed]
+        return self.verify(candidate_ids, lowered)
+
+
+def get_trigram_index(corpus):
+    return corpus.derived("trigram", TrigramIndex)
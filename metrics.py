@@ -0,0 +1,353 @@
+"""قياس زمن المراحل وعدادات الأحداث، مع تسجيل منظم ولقطات لكل عملية تقرؤها لوحة التحكم.
+
+كل زمن يُسجل في مدرج تكراري بحاويات ثابتة الحدود (BUCKET_BOUNDS)، فتُدمج لقطات العمليات
+المختلفة بجمع عدادات الحاويات وتُقدَّر منها المئينات (p50/p95/p99) دون حفظ القياسات نفسها.
+كل عملية تكتب لقطتها كملف JSON في METRICS_DIR كل SNAPSHOT_INTERVAL ثانية وعند إغلاقها.
+
+الاستخدام:
+    python metrics.py [--format json|prometheus] [--output PATH]
+"""
+import argparse
+import atexit
+import json
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".law_cache", "metrics")
+SNAPSHOT_INTERVAL = 15 # ثوانٍ بين كتابتين للقطة العملية
+SNAPSHOT_MAX_AGE = 7 * 86400 # لقطات العمليات المنتهية الأقدم من ذلك تُحذف
+# حدود الحاويات بالثواني: من 0.1 م.ث إلى نحو 100 ث بنسبة 1.5 بين كل حاوية والتي تليها.
+# تغييرها يجعل اللقطات القديمة غير قابلة للدمج، فتُهمل اللقطات ذات الحدود المختلفة.
+BUCKET_BOUNDS = tuple(round(0.0001 * 1.5 ** i, 7) for i in range(35))
+PERCENTILES = (0.5, 0.95, 0.99)
+PROMETHEUS_PREFIX = "laws_"
+
+logger = logging.getLogger("laws")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(os.environ.get("LAWS_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+class Histogram:
+    """مدرج تكراري للأزمنة: عدد القياسات في كل حاوية (الأخيرة لما يتجاوز آخر حد) ومجموعها وأكبرها."""
+
+    __slots__ = ("counts", "total", "max")
+
+    def __init__(self, counts=None, total=0.0, max=0.0):
+        self.counts = list(counts) if counts is not None else [0] * (len(BUCKET_BOUNDS) + 1)
+        self.total = total
+        self.max = max
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, seconds):
+        lo, hi = 0, len(BUCKET_BOUNDS)
+        while lo < hi: # أول حد >= القيمة
+            mid = (lo + hi) // 2
+            if BUCKET_BOUNDS[mid] < seconds:
+                lo = mid + 1
+            else:
+                hi = mid
+        self.counts[lo] += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        """تقدير المئين q (0..1) بالاستيفاء الخطي داخل الحاوية التي يقع فيها."""
+        count = self.count
+        if not count:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKET_BOUNDS[i - 1] if i > 0 else 0.0
+                upper = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {"counts": self.counts, "sum": self.total, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["counts"], data["sum"], data["max"])
+
+
+_histograms = {}
+_counters = {}
+_caches = {}
+_lock = threading.Lock()
+_started = time.time()
+_writer = None
+
+
+def observe(name, seconds):
+    """تسجيل زمن مرحلة بالثواني."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+    _ensure_writer()
+
+
+@contextmanager
+def timer(name):
+    """قياس زمن كتلة with (يُسجل حتى عند حدوث خطأ)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """مزخرف لقياس زمن كل استدعاء للدالة."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+    _ensure_writer()
+
+
+def register_cache(name, cache):
+    """تضمين إحصاءات ذاكرة مؤقتة (أي كائن له stats() مثل ResultCache) في اللقطات."""
+    with _lock:
+        _caches[name] = cache
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """سطر سجل منظم: JSON فيه اسم الحدث وحقوله."""
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, ensure_ascii=False, default=str))
+
+
+def snapshot():
+    """حالة مقاييس هذه العملية كقاموس قابل للتحويل إلى JSON."""
+    with _lock:
+        timers = {name: h.to_dict() for name, h in _histograms.items()}
+        counters = dict(_counters)
+        caches = dict(_caches)
+    return {
+        "pid": os.getpid(),
+        "started": _started,
+        "time": time.time(),
+        "bounds": list(BUCKET_BOUNDS),
+        "timers": timers,
+        "counters": counters,
+        "caches": {name: cache.stats() for name, cache in caches.items()},
+    }
+
+
+def snapshot_file_for(pid):
+    return os.path.join(METRICS_DIR, f"process-{pid}.json")
+
+
+def _write_atomic(path, text):
+    """كتابة ملف بشكل ذري عبر ملف مؤقت فريد في نفس المجلد.
+
+    الخيط الدوري وatexit وأي مستدعٍ مباشر قد يكتبون نفس الملف معًا، فلا يُشارك ملف مؤقت ثابت الاسم.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".metrics-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_snapshot():
+    """كتابة لقطة العملية بشكل ذري في METRICS_DIR."""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_atomic(snapshot_file_for(os.getpid()), json.dumps(snapshot()))
+    except OSError as e:
+        log_event("metrics_snapshot_failed", logging.WARNING, error=str(e))
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _lock:
+        if _writer is not None:
+            return
+        _writer = threading.Thread(target=_write_periodically, name="metrics-snapshot", daemon=True)
+    _writer.start()
+
+
+def _write_periodically():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        write_snapshot()
+
+
+def _write_on_exit():
+    if _writer is not None:
+        write_snapshot()
+
+
+def _reset_after_fork():
+    # العملية الفرعية (مثل عمليات تحليل الملفات) تبدأ مقاييسها من الصفر بلقطتها وخيطها الخاصين
+    global _lock, _writer, _started
+    _lock = threading.Lock()
+    _histograms.clear()
+    _counters.clear()
+    _writer = None
+    _started = time.time()
+
+
+atexit.register(_write_on_exit)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def load_snapshots():
+    """لقطات كل العمليات، مع حذف لقطات العمليات المنتهية منذ أكثر من SNAPSHOT_MAX_AGE."""
+    snapshots = []
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        return snapshots
+    now = time.time()
+    for name in names:
+        if not (name.startswith("process-") and name.endswith(".json")):
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > SNAPSHOT_MAX_AGE:
+                os.remove(path)
+                continue
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if data.get("bounds") == list(BUCKET_BOUNDS):
+            snapshots.append(data)
+    return snapshots
+
+
+def merge_snapshots(snapshots):
+    """دمج لقطات عدة عمليات: جمع الحاويات والعدادات وإحصاءات الذاكرات المؤقتة."""
+    timers, counters, caches = {}, {}, {}
+    for data in snapshots:
+        for name, h in data["timers"].items():
+            histogram = Histogram.from_dict(h)
+            if name in timers:
+                timers[name].merge(histogram)
+            else:
+                timers[name] = histogram
+        for name, value in data["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+        for name, stats in data["caches"].items():
+            merged = caches.setdefault(name, {})
+            for key, value in stats.items():
+                merged[key] = merged.get(key, 0) + value
+    return {"processes": len(snapshots), "timers": timers, "counters": counters, "caches": caches}
+
+
+def summarize(merged):
+    """صف لكل مرحلة: (الاسم، العدد، المتوسط، p50، p95، p99، الأكبر) بالثواني."""
+    rows = []
+    for name, h in sorted(merged["timers"].items()):
+        count = h.count
+        rows.append((name, count, h.total / count if count else None,
+                     *(h.percentile(q) for q in PERCENTILES), h.max))
+    return rows
+
+
+def cache_hit_rate(stats):
+    lookups = stats.get("hits", 0) + stats.get("misses", 0)
+    return stats.get("hits", 0) / lookups if lookups else None
+
+
+def to_json(merged):
+    data = {
+        "processes": merged["processes"],
+        "timers": {},
+        "counters": merged["counters"],
+        "caches": {name: dict(stats, hit_rate=cache_hit_rate(stats)) for name, stats in merged["caches"].items()},
+    }
+    for name, count, mean, p50, p95, p99, largest in summarize(merged):
+        data["timers"][name] = {"count": count, "mean": mean, "p50": p50, "p95": p95, "p99": p99, "max": largest}
+    return json.dumps(data, ensure_ascii=False, indent=1)
+
+
+def _metric_name(name):
+    return PROMETHEUS_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def to_prometheus(merged):
+    """المقاييس بصيغة نص Prometheus (لملف textfile collector مثلًا)."""
+    lines = []
+    for name, h in sorted(merged["timers"].items()):
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, n in zip(BUCKET_BOUNDS, h.counts):
+            cumulative += n
+            lines.append(f'{metric}_bucket{{le="{bound:g}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+        lines.append(f"{metric}_sum {h.total}")
+        lines.append(f"{metric}_count {h.count}")
+    for name, value in sorted(merged["counters"].items()):
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    for field in ("hits", "misses"):
+        metric = f"{PROMETHEUS_PREFIX}cache_{field}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for name, stats in sorted(merged["caches"].items()):
+            lines.append(f'{metric}{{cache="{name}"}} {stats.get(field, 0)}')
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="تصدير مقاييس الأداء المدمجة من لقطات كل العمليات.")
+    parser.add_argument("--format", choices=("json", "prometheus"), default="json", help="صيغة التصدير (الافتراضي: json)")
+    parser.add_argument("--output", default=None, help="ملف الإخراج (الافتراضي: المخرج القياسي)")
+    args = parser.parse_args(argv)
+
+    merged = merge_snapshots(load_snapshots())
+    text = to_json(merged) if args.format == "json" else to_prometheus(merged)
+    if args.output is None:
+        sys.stdout.write(text)
+        return 0
+    _write_atomic(args.output, text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""ذاكرة مؤقتة مشتركة بين الجلسات (LRU) بحد للعدد والحجم ومدة صلاحية، آمنة بين الخيوط."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """ذاكرة LRU مشتركة مع عدادات الإصابة والإخفاق.
+
+    الحجم يُقاس بالدالة sizeof (افتراضيًا len للقيمة)، ويُطرد الأقدم استخدامًا عند تجاوز
+    max_entries أو max_size. العناصر الأقدم من ttl ثانية تُعامل كغير موجودة.
+    """
+
+    def __init__(self, max_entries, max_size=None, ttl=None, sizeof=len):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (وقت التخزين، الحجم، القيمة)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """القيمة المخزنة أو None، مع تحديث ترتيب الاستخدام والعدادات."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if self.max_size is not None and size > self.max_size:
+                return
+            self._entries[key] = (time.monotonic(), size, value)
+            self._size += size
+            while len(self._entries) > self.max_entries or (self.max_size is not None and self._size > self.max_size):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "size": self._size}
@@ -1,56 +1,39 @@
 import streamlit as st
 import streamlit.components.v1 as components
-from docx import Document
-import re
 import os
 import time
+import logging
 import base64
-import sqlite3
 import uuid
+from collections import namedtuple
+import db
+import metrics
+from activity_tracker import record_activity
+from law_corpus import get_corpus
+from law_search import SearchHit, SearchJob, iter_law_files, iter_search_hits, prepare_indexes, rank_hits, refine_search, search_cache, search_cache_key
+from law_query import QuerySyntaxError
+from law_highlight import extract_context_from_spans
+from law_lookup import get_article_lookup, lookup_reference
+from law_similar import get_similarity_index
+from law_export import (
+    EXPORT_FORMATS, LARGE_EXPORT_THRESHOLD, ExportJob, cache_export, export_filename, export_mime,
+    export_results, get_cached_export,
+)
 
 st.set_page_config(page_title="القوانين اليمنية بآخر تعديلاتها حتى عام 2025م", layout="wide")
 st.markdown("<h1 style='text-align: center;'>مرحبًا بك في تطبيق القوانين اليمنية بآخر تعديلاتها حتى عام 2025م</h1>", unsafe_allow_html=True)
 
 TRIAL_DURATION = 300 # 5 minutes in seconds (يجب أن تتطابق مع لوحة التحكم)
-DATABASE_FILE = os.path.join(os.path.dirname(__file__), "user_data.db")
-
-def init_db():
-    """تهيئة قاعدة البيانات وإنشاء الجداول إذا لم تكن موجودة."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    # جدول المستخدمين
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id TEXT PRIMARY KEY,
-            is_activated INTEGER DEFAULT 0,
-            trial_start_time REAL,
-            last_activity_time REAL,
-            activation_code_used TEXT
-        )
-    ''')
-    # جدول أكواد التفعيل
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS activation_codes (
-            code TEXT PRIMARY KEY,
-            is_used INTEGER DEFAULT 0,
-            used_by_user_id TEXT,
-            FOREIGN KEY (used_by_user_id) REFERENCES users(user_id)
-        )
-    ''')
-    # جدول طلبات التفعيل الجديدة
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS activation_requests (
-            request_id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            activation_code TEXT,
-            request_time REAL NOT NULL,
-            status TEXT DEFAULT 'pending', -- 'pending', 'approved', 'rejected'
-            FOREIGN KEY (user_id) REFERENCES users(user_id),
-            FOREIGN KEY (activation_code) REFERENCES activation_codes(code)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+LIVE_RESULTS_LIMIT = 20 # عدد النتائج المعروضة أثناء تقدم البحث
+EXPORT_POLL_INTERVAL = 0.5 # ثوانٍ بين تحديثات شريط تقدم التصدير الكبير
+PAGE_SIZE_OPTIONS = [10, 20, 50, 100]
+DEFAULT_PAGE_SIZE = 20
+RELATED_LIMIT = 5 # عدد المواد ذات الصلة من نفس القانون ومن القوانين الأخرى
+RELATED_PREVIEW_CHARS = 150
+BOOTSTRAP_TTL = 30 # ثوانٍ تُستخدم فيها حالة المستخدم المخزنة في الجلسة دون الرجوع إلى القاعدة
+
+# حالة المستخدم كما تقرؤها fetch_user_status
+UserStatus = namedtuple("UserStatus", ["activated", "trial_start_time", "trial_remaining", "request_status"])
 
 def get_user_id():
     user_id_file = "user_id.txt"
@@ -63,149 +46,283 @@ def get_user_id():
         with open(user_id_file, "w") as f:
             f.write(new_id)
 
-    # تأكد من إدخال المستخدم في قاعدة البيانات
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (st.session_state.user_id,))
-    conn.commit()
-    conn.close()
-
     return st.session_state.user_id
 
-def update_last_activity(user_id):
-    """تحديث وقت آخر نشاط للمستخدم."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("UPDATE users SET last_activity_time = ? WHERE user_id = ?", (time.time(), user_id))
-    conn.commit()
-    conn.close()
-
-def is_activated(user_id):
-    """التحقق مما إذا كان المستخدم مفعلًا من قاعدة البيانات."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT is_activated FROM users WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] == 1 if result else False
-
-def get_trial_start_time(user_id):
-    """الحصول على وقت بدء تجربة المستخدم من قاعدة البيانات."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT trial_start_time FROM users WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
+@metrics.timed("app.bootstrap")
+def fetch_user_status(user_id):
+    """قراءة حالة المستخدم كاملة في استعلام واحد، مع إنشائه (أو إعادته من الأرشيف) عند أول زيارة.
+
+    تعيد التفعيل ووقت بدء التجربة والوقت المتبقي منها (بالثواني) وحالة آخر طلب تفعيل.
+    آخر نشاط لا يُكتب هنا بل عبر activity_tracker، فالاستعلام قراءة فقط في الحالة المعتادة.
+    """
+    with db.connection() as conn:
+        for _ in range(2):
+            row = conn.execute('''
+                SELECT
+                    is_activated,
+                    trial_start_time,
+                    CASE WHEN trial_start_time IS NULL THEN NULL ELSE MAX(0, ? - (? - trial_start_time)) END,
+                    (SELECT status FROM activation_requests r WHERE r.user_id = users.user_id
+                     ORDER BY r.request_time DESC LIMIT 1)
+                FROM users WHERE user_id = ?
+            ''', (TRIAL_DURATION, time.time(), user_id)).fetchone()
+            if row is not None:
+                return UserStatus(row[0] == 1, row[1], row[2], row[3])
+            # مستخدم نقلته الصيانة إلى الأرشيف يعود بحالته، وإلا يُنشأ من جديد
+            conn.execute('''
+                INSERT OR IGNORE INTO users (user_id, is_activated, trial_start_time, last_activity_time, activation_code_used)
+                SELECT user_id, is_activated, trial_start_time, ?, activation_code_used FROM users_archive WHERE user_id = ?
+            ''', (time.time(), user_id))
+            conn.execute("DELETE FROM users_archive WHERE user_id = ?", (user_id,))
+            conn.execute("INSERT OR IGNORE INTO users (user_id, last_activity_time) VALUES (?, ?)", (user_id, time.time()))
+    return UserStatus(False, None, None, None)
+
+def get_user_status(user_id):
+    """حالة المستخدم من الجلسة إذا كانت أحدث من BOOTSTRAP_TTL، وإلا من القاعدة."""
+    cached = st.session_state.get("user_status")
+    if cached is not None and cached[0] == user_id and time.monotonic() - cached[1] < BOOTSTRAP_TTL:
+        return cached[2]
+    status = fetch_user_status(user_id)
+    st.session_state.user_status = (user_id, time.monotonic(), status)
+    return status
+
+def invalidate_user_status():
+    """إلغاء الحالة المخزنة في الجلسة بعد تغييرها (بدء التجربة أو إرسال طلب)."""
+    st.session_state.pop("user_status", None)
 
 def set_trial_start_time(user_id):
     """تعيين وقت بدء تجربة المستخدم في قاعدة البيانات."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,)) # للتأكد من وجود المستخدم
-    c.execute("UPDATE users SET trial_start_time = ?, is_activated = 0 WHERE user_id = ?", (time.time(), user_id))
-    conn.commit()
-    conn.close()
+    with db.connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,)) # للتأكد من وجود المستخدم
+        conn.execute("UPDATE users SET trial_start_time = ?, is_activated = 0 WHERE user_id = ?", (time.time(), user_id))
+    invalidate_user_status()
 
 def send_activation_request(user_id, code):
     """إرسال طلب تفعيل للتطبيق من قبل المستخدم."""
-    # --- بداية عبارات DEBUG print ---
-    print(f"DEBUG: send_activation_request called for user_id: {user_id}, code: {code}") 
-    # --- نهاية عبارات DEBUG print ---
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-
-    # التحقق من صلاحية الكود قبل إرسال الطلب
-    c.execute("SELECT is_used FROM activation_codes WHERE code = ?", (code,))
-    code_status = c.fetchone()
-    # --- بداية عبارات DEBUG print ---
-    print(f"DEBUG: Code status for '{code}': {code_status}") 
-    # --- نهاية عبارات DEBUG print ---
-
-    if code_status and code_status[0] == 0: # الكود موجود وغير مستخدم
-        # --- بداية عبارات DEBUG print ---
-        print(f"DEBUG: Code '{code}' is valid and unused. Proceeding to send request.") 
-        # --- نهاية عبارات DEBUG print ---
-        try:
+    try:
+        # المعاملة تحجز القفل قبل فحص الكود، فلا يطلب مستخدمان نفس الكود في نفس الوقت
+        with db.transaction() as conn:
+            # التحقق من صلاحية الكود قبل إرسال الطلب
+            code_status = conn.execute("SELECT is_used FROM activation_codes WHERE code = ?", (code,)).fetchone()
+            if not (code_status and code_status[0] == 0): # الكود غير موجود أو مستخدم
+                metrics.incr("activation.request_rejected_code")
+                metrics.log_event("activation_request", user_id=user_id, outcome="invalid_code",
+                                  code_found=code_status is not None)
+                return False
+
             # قم بوضع الكود في حالة "قيد الاستخدام المؤقت" لمنع مستخدم آخر من طلبه
-            c.execute("UPDATE activation_codes SET is_used = 1, used_by_user_id = ? WHERE code = ?", (user_id, code))
-            # --- بداية عبارات DEBUG print ---
-            print(f"DEBUG: Updated activation_codes table. Rows affected: {c.rowcount}") 
-            # --- نهاية عبارات DEBUG print ---
-            
+            conn.execute("UPDATE activation_codes SET is_used = 1, used_by_user_id = ? WHERE code = ?", (user_id, code))
+
             # إنشاء طلب تفعيل جديد
             request_id = str(uuid.uuid4())
-            c.execute("INSERT INTO activation_requests (request_id, user_id, activation_code, request_time, status) VALUES (?, ?, ?, ?, 'pending')",
-                      (request_id, user_id, code, time.time()))
-            # --- بداية عبارات DEBUG print ---
-            print(f"DEBUG: Inserted into activation_requests. Rows affected: {c.rowcount}, request_id: {request_id}") 
-            # --- نهاية عبارات DEBUG print ---
-            conn.commit()
-            # --- بداية عبارات DEBUG print ---
-            print("DEBUG: Database commit successful.") 
-            # --- نهاية عبارات DEBUG print ---
-            conn.close()
-            return True
-        except Exception as e:
-            # --- بداية عبارات DEBUG print ---
-            print(f"DEBUG ERROR: An exception occurred during request sending: {e}") 
-            # --- نهاية عبارات DEBUG print ---
-            st.error(f"حدث خطأ أثناء إرسال الطلب: {e}")
-            conn.rollback()
-            conn.close()
-            return False
-    else:
-        # --- بداية عبارات DEBUG print ---
-        print(f"DEBUG: Code '{code}' is either not found or already used. Code status: {code_status}") 
-        # --- نهاية عبارات DEBUG print ---
-        conn.close()
+            conn.execute("INSERT INTO activation_requests (request_id, user_id, activation_code, request_time, status) VALUES (?, ?, ?, ?, 'pending')",
+                         (request_id, user_id, code, time.time()))
+        metrics.incr("activation.request_sent")
+        metrics.log_event("activation_request", user_id=user_id, outcome="sent", request_id=request_id)
+        invalidate_user_status()
+        return True
+    except Exception as e:
+        metrics.incr("activation.request_failed")
+        metrics.log_event("activation_request", logging.ERROR, user_id=user_id, outcome="error", error=repr(e))
+        st.error(f"حدث خطأ أثناء إرسال الطلب: {e}")
         return False
 
-def get_activation_request_status(user_id):
-    """الحصول على حالة طلب التفعيل للمستخدم."""
-    conn = sqlite3.connect(DATABASE_FILE)
-    c = conn.cursor()
-    c.execute("SELECT status FROM activation_requests WHERE user_id = ? ORDER BY request_time DESC LIMIT 1", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def highlight_keywords(text, keywords):
-    text = str(text)
-    text = text.replace('\xa0', ' ').replace('\u200b', '') 
-    
-    for kw in keywords:
-        text = re.sub(f"({re.escape(kw)})", r"<mark>\1</mark>", text, flags=re.IGNORECASE | re.UNICODE)
-    return text
-
-def extract_context(paragraphs, keywords, context_lines=3): 
-    paragraphs = [str(p).replace('\xa0', ' ').replace('\u200b', '') for p in paragraphs] 
-    
-    search_pattern = re.compile('|'.join([re.escape(kw) for kw in keywords]), re.IGNORECASE | re.UNICODE)
-    
-    matched_indexes = []
-    for i, line in enumerate(paragraphs):
-        if search_pattern.search(line):
-            matched_indexes.append(i)
-            
-    context_set = set()
-    for idx in matched_indexes:
-        for i in range(max(0, idx - context_lines), min(len(paragraphs), idx + context_lines + 1)):
-            context_set.add(i)
-            
-    filtered_paragraphs = [paragraphs[i] for i in sorted(context_set) if paragraphs[i].strip()]
-    return "\n".join(filtered_paragraphs)
-
-
-def export_results_to_docx(results, filename="نتائج_البحث.docx"):
-    doc = Document()
-    doc.add_heading("نتائج البحث", 0)
-    for r in results:
-        doc.add_heading(f'{r["law"]} - المادة {r["num"]}', level=1)
-        doc.add_paragraph(r["context"])
-    filepath = os.path.join(os.getcwd(), filename)
-    doc.save(filepath)
-    return filepath
+def hit_article(corpus, hit):
+    return corpus.entries()[hit.article_id][1]
+
+
+def result_view(corpus, hit):
+    """بيانات عرض نتيجة واحدة، تُشتق عند الحاجة فقط (للبطاقات الظاهرة والتصدير)."""
+    article = hit_article(corpus, hit)
+    context, highlighted = extract_context_from_spans(article.paragraphs, hit.span_pairs(), context_lines=3)
+    return {
+        "law": article.law,
+        "num": article.num,
+        "text": highlighted,
+        "context": context,
+    }
+
+
+def iter_search_results(corpus, query_text, folder_filter, cancel_event=None, law=None):
+    """نتائج البحث مضغوطة (SearchHit)، دفعة لكل قانون."""
+    for _, hits in iter_search_hits(corpus, query_text, folder_filter, law, cancel_event):
+        yield [SearchHit(article_id, spans, rank) for article_id, spans, rank in hits]
+
+
+@metrics.timed("search.sync")
+def run_search(corpus, query_text, folder_filter, law=None):
+    """تنفيذ البحث كاملًا في نفس الخيط (للاستعلامات الصغيرة مثل فلترة قانون واحد)."""
+    key = search_cache_key(corpus, query_text, folder_filter, law)
+    hits = search_cache.get(key)
+    if hits is None:
+        hits = tuple(rank_hits(hit for batch in iter_search_results(corpus, query_text, folder_filter, law=law) for hit in batch))
+        search_cache.put(key, hits)
+    return list(hits)
+
+
+def render_card(law, num, body):
+    st.markdown(f"""
+<div style="background-color:#f1f8e9;padding:15px;margin-bottom:15px;border-radius:10px;
+            border:1px solid #c5e1a5;direction:rtl;text-align:right; overflow-wrap: break-word;">
+    <p style="font-weight:bold;font-size:18px;margin:0">🔷 {law} - المادة {num}</p>
+    <p style="font-size:17px;line-height:1.8;margin-top:10px">
+        {body}
+    </p>
+</div>
+""", unsafe_allow_html=True)
+
+
+@metrics.timed("render.card")
+def render_result_card(corpus, hit):
+    r = result_view(corpus, hit)
+    render_card(r["law"], r["num"], r["text"])
+
+
+def render_related(corpus, article_id, key):
+    """زر "مواد ذات صلة" تحت البطاقة؛ الجيران يُحسبون (أو يُقرؤون محسوبين مسبقًا) عند فتحه فقط."""
+    if not st.toggle("🔗 مواد ذات صلة", key=key):
+        return
+    entries = corpus.entries()
+    same_law, other_laws = get_similarity_index(corpus).related(article_id, RELATED_LIMIT)
+    for title, related in (("من نفس القانون", same_law), ("من قوانين أخرى", other_laws)):
+        lines = []
+        for related_id, score in related:
+            article = entries[related_id][1]
+            preview = " ".join(p for p in article.paragraphs if p.strip())[:RELATED_PREVIEW_CHARS]
+            lines.append(f"- **{article.law} - المادة {article.num}** ({score:.0%}): {preview}...")
+        st.markdown(f"**{title}:**\n" + ("\n".join(lines) if lines else "لا توجد مواد مشابهة."))
+
+
+def _show_article(index, article_id):
+    st.session_state.lookup_ids[index] = article_id
+
+
+def render_article_lookup(corpus, article_ids):
+    """عرض المواد المطلوبة برقمها كاملة، مع الانتقال إلى المادة السابقة والتالية من الفهرس."""
+    if not article_ids:
+        st.warning("⚠️ لم يتم العثور على المادة المطلوبة. تأكد من رقم المادة واسم القانون.")
+        return
+    lookup = get_article_lookup(corpus)
+    for index, article_id in enumerate(article_ids):
+        article = corpus.entries()[article_id][1]
+        render_card(article.law, article.num, "<br>".join(p for p in article.paragraphs if p.strip()))
+        render_related(corpus, article_id, f"related_lookup_{index}_{article_id}")
+        previous_id, next_id = lookup.neighbours(article_id)
+        col_prev, col_next = st.columns(2)
+        with col_prev:
+            st.button("⬅️ المادة السابقة", key=f"lookup_prev_{index}", disabled=previous_id is None,
+                      on_click=_show_article, args=(index, previous_id))
+        with col_next:
+            st.button("المادة التالية ➡️", key=f"lookup_next_{index}", disabled=next_id is None,
+                      on_click=_show_article, args=(index, next_id))
+
+
+def _change_page(state_key, delta):
+    st.session_state[state_key] = st.session_state.get(state_key, 0) + delta
+
+
+def render_results_page(corpus, results, state_key, page_size):
+    """عرض صفحة واحدة فقط من النتائج؛ البطاقات تُنشأ للنافذة الظاهرة وحدها."""
+    page_count = max(1, -(-len(results) // page_size))
+    page = min(max(st.session_state.get(state_key, 0), 0), page_count - 1)
+    st.session_state[state_key] = page
+
+    for hit in results[page * page_size:(page + 1) * page_size]:
+        render_result_card(corpus, hit)
+        render_related(corpus, hit.article_id, f"related_{state_key}_{hit.article_id}")
+
+    if page_count > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("⬅️ السابق", key=f"{state_key}_prev", disabled=page == 0,
+                      on_click=_change_page, args=(state_key, -1))
+        with col_info:
+            st.markdown(f"<p style='text-align:center'>الصفحة {page + 1} من {page_count} ({len(results)} نتيجة)</p>", unsafe_allow_html=True)
+        with col_next:
+            st.button("التالي ➡️", key=f"{state_key}_next", disabled=page >= page_count - 1,
+                      on_click=_change_page, args=(state_key, 1))
+
+
+def follow_search_job(corpus, job):
+    """عرض تقدم البحث الجاري وأول النتائج فور وصولها حتى ينتهي البحث أو يُلغى."""
+    stop_slot = st.empty()
+    if stop_slot.button("⏹️ إيقاف البحث", key="cancel_search_button"):
+        job.cancel()
+        return
+    progress = st.progress(0.0, text="⏳ جارٍ البحث...")
+    placeholder = st.empty()
+    live = placeholder.container()
+    shown = 0
+    seen = 0
+    while True:
+        seen = job.wait(seen)
+        fraction = job.laws_done / job.total if job.total else 1.0
+        progress.progress(min(fraction, 1.0), text=f"⏳ جارٍ البحث... {job.laws_done}/{job.total} قانون، {seen} نتيجة حتى الآن")
+        # عرض أول النتائج فقط أثناء البحث؛ العرض الكامل بعد الانتهاء
+        while shown < min(seen, LIVE_RESULTS_LIMIT):
+            with live:
+                render_result_card(corpus, job.results[shown])
+            shown += 1
+        if job.finished:
+            break
+    stop_slot.empty()
+    progress.empty()
+    placeholder.empty()
+
+
+def render_export(corpus, results, export_key):
+    """تصدير النتائج عند الطلب فقط، مع إعادة استخدام الملف الجاهز لنفس البحث والفلتر ونسخة المكتبة."""
+    fmt = st.radio("صيغة التصدير", list(EXPORT_FORMATS), horizontal=True)
+    key = (fmt,) + export_key
+    data = get_cached_export(key)
+    if data is None and fmt == "Word" and len(results) > LARGE_EXPORT_THRESHOLD:
+        data = follow_export_job(corpus, results, key)
+    elif data is None and st.button("📄 تجهيز ملف التصدير"):
+        with st.spinner("جاري تجهيز الملف..."):
+            data = export_results((result_view(corpus, hit) for hit in results), fmt, key)
+    if data is not None:
+        st.download_button(
+            label=f"📥 تحميل النتائج كملف {fmt}",
+            data=data,
+            file_name=export_filename(fmt),
+            mime=export_mime(fmt)
+        )
+
+
+@st.fragment(run_every=EXPORT_POLL_INTERVAL)
+def render_export_progress(job):
+    """شريط تقدم التصدير: يُعاد رسمه وحده كل فترة دون حجز خيط الصفحة، وعند الاكتمال تُعاد الصفحة لعرض زر التحميل."""
+    if job.finished:
+        st.rerun()
+    st.progress(job.written / max(job.total, 1), text=f"جاري كتابة الملف: {job.written} من {job.total} نتيجة")
+
+
+def follow_export_job(corpus, results, key):
+    """تصدير كبير يُكتب إلى ملف مؤقت في الخلفية؛ تعيد المحتوى عند اكتماله."""
+    job = st.session_state.get("export_job")
+    if job is not None and job.key != key:
+        job.discard()
+        job = st.session_state.export_job = None
+    if job is None:
+        if st.button(f"📄 تجهيز ملف Word في الخلفية ({len(results)} نتيجة)"):
+            rows = (result_view(corpus, hit) for hit in results)
+            job = st.session_state.export_job = ExportJob(rows, len(results), key)
+        else:
+            return None
+
+    if not job.finished:
+        render_export_progress(job)
+        return None
+    st.session_state.export_job = None
+    if job.error is not None:
+        job.discard()
+        st.error(f"❌ تعذر تجهيز الملف: {job.error}")
+        return None
+    data = job.read()
+    job.discard()
+    cache_export(key, data)
+    return data
+
 
 def run_main_app_logic():
     components.html("""
@@ -230,23 +347,17 @@ def run_main_app_logic():
     <button class='scroll-btn' id='scroll-bottom-btn' onclick='window.scrollTo({top: document.body.scrollHeight, behavior: "smooth"});'>⬇️</button>
     """, height=1)
 
-    subfolders = [f.path for f in os.scandir() if f.is_dir() and f.name not in [".git", ".streamlit"]]
+    corpus = get_corpus()
+    prepare_indexes(corpus)
+    subfolders = list(corpus.folders)
     if not subfolders:
         st.warning("📂 لا توجد مجلدات قوانين.")
         return
 
     selected_folder = st.selectbox("اختر مجلدًا للبحث فيه:", ["🔍 كل المجلدات"] + subfolders)
 
-    all_files = {}
-    if selected_folder == "🔍 كل المجلدات":
-        for folder in subfolders:
-            files = [f for f in os.listdir(folder) if f.endswith(".docx")]
-            all_files[folder] = files
-    else:
-        files = [f for f in os.listdir(selected_folder) if f.endswith(".docx")]
-        all_files[selected_folder] = files
-
-    keywords = st.text_area("الكلمات المفتاحية (افصل بفاصلة)", "")
+    keywords = st.text_area("الكلمات المفتاحية (افصل بفاصلة)", "",
+                            help='للوصول إلى مادة مباشرة: المادة 312 من القانون المدني. للبحث المتقدم: كلمة1 & كلمة2 (كلاهما)، كلمة1 | كلمة2 (أيهما)، -كلمة (استبعاد)، "عبارة كاملة"، كلمة1 ~5 كلمة2 (على بعد 5 كلمات أو أقل).')
 
     if "results" not in st.session_state:
         st.session_state.results = []
@@ -254,121 +365,142 @@ def run_main_app_logic():
         st.session_state.search_done = False
 
     if st.button("🔍 بدء البحث") and keywords:
-        kw_list = [k.strip() for k in keywords.split(",") if k.strip()]
-        results = []
-
-        for folder, files in all_files.items():
-            for file in files:
-                doc_path = os.path.join(folder, file)
-                try:
-                    doc = Document(doc_path)
-                except Exception as e:
-                    st.warning(f"⚠️ تعذر قراءة الملف {file} في المجلد {folder}: {e}. قد يكون الملف تالفًا أو مشفرًا.")
-                    continue
-
-                law_name = file.replace(".docx", "")
-                
-                all_paragraphs_in_doc = [p.text.strip() for p in doc.paragraphs if p.text.strip()]
-                
-                current_article_paragraphs = []
-                last_article_num = "غير معروفة"
-
-                for i, para_text in enumerate(all_paragraphs_in_doc): 
-                    match = re.match(r"مادة\s*\(?\s*(\d+)\)?", para_text)
-                    if match:
-                        if current_article_paragraphs:
-                            full_article_text = "\n".join(current_article_paragraphs)
-                            if any(kw.lower() in full_article_text.lower() for kw in kw_list):
-                                context = extract_context(current_article_paragraphs, kw_list, context_lines=3) 
-                                results.append({
-                                    "law": law_name,
-                                    "num": last_article_num,
-                                    "text": highlight_keywords(context, kw_list),
-                                    "plain": full_article_text,
-                                    "context": context,
-                                    "keywords": kw_list
-                                })
-                            current_article_paragraphs = []
-                        last_article_num = match.group(1)
-                        current_article_paragraphs.append(para_text)
-                    else:
-                        current_article_paragraphs.append(para_text)
-                
-                if current_article_paragraphs:
-                    full_article_text = "\n".join(current_article_paragraphs)
-                    if any(kw.lower() in full_article_text.lower() for kw in kw_list):
-                        context = extract_context(current_article_paragraphs, kw_list, context_lines=3) 
-                        results.append({
-                            "law": law_name,
-                            "num": last_article_num,
-                            "text": highlight_keywords(context, kw_list),
-                            "plain": full_article_text,
-                            "context": context,
-                            "keywords": kw_list
-                        })
-
-        st.session_state.results = results
-        st.session_state.search_done = True
+        folder_filter = None if selected_folder == "🔍 كل المجلدات" else selected_folder
+        for path, error in corpus.errors.items():
+            if folder_filter is None or os.path.dirname(path) == os.path.abspath(folder_filter):
+                st.warning(f"⚠️ تعذر قراءة الملف {os.path.basename(path)}: {error}. قد يكون الملف تالفًا أو مشفرًا.")
+
+        previous_job = st.session_state.get("search_job")
+        if previous_job is not None:
+            previous_job.cancel()
+        previous_hits = st.session_state.results if st.session_state.get("results_complete") else None
+        previous_corpus = st.session_state.get("results_corpus")
+        st.session_state.search_job = None
+        st.session_state.results = []
+        st.session_state.search_done = False
+        st.session_state.results_complete = False
+        st.session_state.lookup_ids = None
+        article_ids = lookup_reference(corpus, keywords, folder_filter)
+        if article_ids is not None:
+            # إشارة مباشرة إلى مادة ("المادة 312 من القانون المدني"): تُعرض من الفهرس دون بحث
+            st.session_state.lookup_ids = article_ids
+            st.session_state.lookup_corpus = corpus
+        else:
+            try:
+                # يحلل الاستعلام المتقدم فتظهر أخطاء الصيغة فورًا قبل بدء البحث
+                cache_key = search_cache_key(corpus, keywords, folder_filter)
+            except QuerySyntaxError as e:
+                st.error(f"❌ صيغة البحث غير صحيحة: {e}")
+            else:
+                cached = search_cache.get(cache_key)
+                if cached is None and previous_hits is not None and previous_corpus is corpus:
+                    # بحث يضيق البحث السابق يُقيَّم على نتائجه فقط
+                    query_text, previous_folder = st.session_state.last_query
+                    cached = refine_search(corpus, keywords, folder_filter, None, (query_text, previous_folder, None), previous_hits)
+                    if cached is not None:
+                        search_cache.put(cache_key, tuple(cached))
+                if cached is not None:
+                    st.session_state.results = list(cached)
+                    st.session_state.search_done = True
+                    st.session_state.results_complete = True
+                else:
+                    total = sum(1 for _ in iter_law_files(corpus, folder_filter))
+                    st.session_state.search_job = SearchJob(
+                        lambda cancel_event: iter_search_results(corpus, keywords, folder_filter, cancel_event), total, cache_key
+                    )
+                st.session_state.last_query = (keywords, folder_filter)
+                # النتائج تشير إلى مواد هذه النسخة من المكتبة، فتُحفظ معها
+                st.session_state.results_corpus = corpus
+                st.session_state.search_serial = st.session_state.get("search_serial", 0) + 1
+
+    if st.session_state.get("lookup_ids") is not None:
+        render_article_lookup(st.session_state.lookup_corpus, st.session_state.lookup_ids)
+
+    job = st.session_state.get("search_job")
+    if job is not None:
+        if not job.finished and not job.cancelled:
+            # أرقام المواد في نتائج المهمة تشير إلى النسخة التي بدأ عليها البحث
+            follow_search_job(st.session_state.results_corpus, job)
+        if job.finished or job.cancelled:
+            if job.error is not None:
+                st.error(f"❌ حدث خطأ أثناء البحث: {job.error}")
+            elif job.cancelled and not job.finished:
+                st.info(f"⏹️ تم إيقاف البحث. النتائج التالية جزئية ({job.laws_done} من {job.total} قانون).")
+            st.session_state.results = list(job.results)
+            st.session_state.search_done = True
+            st.session_state.results_complete = job.error is None and not job.cancelled
+            st.session_state.search_job = None
 
     if st.session_state.search_done and st.session_state.results:
         results = st.session_state.results
-        unique_laws = sorted(set(r["law"] for r in results))
+        corpus = st.session_state.results_corpus
+        unique_laws = sorted(set(hit_article(corpus, hit).law for hit in results))
         st.success(f"تم العثور على {len(results)} نتيجة في {len(unique_laws)} قانون/ملف.")
         
         selected_law = st.selectbox("فلترة حسب القانون", ["الكل"] + unique_laws)
-        filtered = results if selected_law == "الكل" else [r for r in results if r["law"] == selected_law]
-
-        for r in filtered:
-            st.markdown(f"""
-<div style="background-color:#f1f8e9;padding:15px;margin-bottom:15px;border-radius:10px;
-            border:1px solid #c5e1a5;direction:rtl;text-align:right; overflow-wrap: break-word;">
-    <p style="font-weight:bold;font-size:18px;margin:0">🔷 {r["law"]} - المادة {r["num"]}</p>
-    <p style="font-size:17px;line-height:1.8;margin-top:10px">
-        {r["text"]}
-    </p>
-</div>
-""", unsafe_allow_html=True)
+        if selected_law == "الكل":
+            filtered = results
+        else:
+            query_text, folder_filter = st.session_state.last_query
+            filtered = None
+            if st.session_state.get("results_complete"):
+                # النتائج مكتملة، فالفلترة تصفية لها دون بحث جديد
+                filtered = refine_search(corpus, query_text, folder_filter, selected_law,
+                                         (query_text, folder_filter, None), results)
+            if filtered is None:
+                filtered = run_search(corpus, query_text, folder_filter, selected_law)
+
+        col_size, col_group = st.columns(2)
+        with col_size:
+            page_size = st.selectbox("عدد النتائج في الصفحة", PAGE_SIZE_OPTIONS,
+                                     index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE))
+        with col_group:
+            group_by_law = st.toggle("تجميع النتائج حسب القانون", value=False)
+
+        # رقم البحث جزء من مفاتيح الصفحات حتى يبدأ كل بحث جديد من الصفحة الأولى
+        serial = st.session_state.get("search_serial", 0)
+        if group_by_law:
+            groups = {}
+            for hit in filtered:
+                groups.setdefault(hit_article(corpus, hit).law, []).append(hit)
+            for law, law_results in groups.items():
+                # القسم لا يُنشئ بطاقاته إلا عند فتحه
+                if st.toggle(f"📘 {law} ({len(law_results)} نتيجة)", key=f"law_group_{serial}_{law}"):
+                    render_results_page(corpus, law_results, f"page_{serial}_{law}", page_size)
+        else:
+            render_results_page(corpus, filtered, f"page_{serial}_{selected_law}", page_size)
 
         if filtered:
-            filepath = export_results_to_docx(filtered)
-            with open(filepath, "rb") as f:
-                st.download_button(
-                    label="📥 تحميل النتائج كملف Word",
-                    data=f,
-                    file_name="نتائج_البحث.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-                )
+            query_text, folder_filter = st.session_state.last_query
+            render_export(corpus, filtered, (query_text, folder_filter, selected_law, corpus.version))
 
 def main():
-    init_db()
     user_id = get_user_id()
-    update_last_activity(user_id)
-
-    if "activated" not in st.session_state:
-        st.session_state.activated = is_activated(user_id)
+    record_activity(user_id)
+    # استعلام واحد لكل BOOTSTRAP_TTL بدل خمسة استعلامات متتالية في كل إعادة تشغيل للصفحة
+    status = get_user_status(user_id)
 
-    if not st.session_state.activated:
+    if not status.activated:
         st.warning("⚠️ التطبيق غير مفعل. يرجى التفعيل أو استخدام النسخة التجريبية.")
         
-        trial_start_time = get_trial_start_time(user_id)
-        
-        if trial_start_time is None:
+        if status.trial_start_time is None:
             if st.button("🕒 بدء التجربة المجانية", key="start_trial_button"):
                 set_trial_start_time(user_id)
                 st.session_state.trial_start_time = time.time()
                 st.success("🎉 بدأت النسخة التجريبية. لديك 5 دقائق. يرجى تحديث الصفحة أو إعادة تشغيل التطبيق.")
                 st.rerun() 
         else:
-            time_elapsed = time.time() - trial_start_time
-            if time_elapsed < TRIAL_DURATION:
-                remaining_minutes = int((TRIAL_DURATION - time_elapsed) / 60)
+            # المتبقي محسوب وقت قراءة الحالة، فيُطرح منه ما مضى منذ ذلك الحين
+            trial_remaining = status.trial_remaining - (time.monotonic() - st.session_state.user_status[1])
+            if trial_remaining > 0:
+                remaining_minutes = int(trial_remaining / 60)
                 st.info(f"✅ النسخة التجريبية نشطة. تبقى لديك حوالي {remaining_minutes} دقيقة.")
                 run_main_app_logic()
             else:
                 st.error("❌ انتهت مدة التجربة المجانية. يرجى التفعيل.")
         
         # --- بداية التعديلات لآلية طلب التفعيل ---
-        request_status = get_activation_request_status(user_id)
+        request_status = status.request_status
         
         if request_status == 'pending':
             st.info("⏳ لقد أرسلت طلب تفعيل. نرجو الانتظار حتى تتم موافقة المسؤول. يمكنك تحديث الصفحة للتحقق من الحالة.")
@@ -394,4 +526,5 @@ def main():
     else:
         run_main_app_logic()
 
-main()
+with metrics.timer("app.page"):
+    main()
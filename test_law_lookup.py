@@ -0,0 +1,28 @@
+"""اختبارات الوصول المباشر إلى المواد على مكتبة صغيرة في الذاكرة.
+
+التشغيل من مجلد المستودع: python -m pytest -q test_law_lookup.py
+"""
+import pytest
+
+from law_corpus import Article, Corpus, LawFile
+from law_lookup import lookup_reference
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    law_files = []
+    for law in ("القانون المدني", "القانون التجاري"):
+        articles = tuple(Article(law, str(num), [f"مادة ({num})", f"نص المادة {num} من {law}."]) for num in (1, 5, 12))
+        law_files.append(LawFile("laws", f"laws/{law}.docx", law, articles))
+    return Corpus("test", ["laws"], {}, law_files, {})
+
+
+def test_reference_to_known_law(corpus):
+    assert lookup_reference(corpus, "المادة 5 من القانون المدني") == [1]
+    assert lookup_reference(corpus, "مادة (12) التجاري") == [5]
+    assert lookup_reference(corpus, "المادة 5") == [1, 4]
+
+
+@pytest.mark.parametrize("text", ["المادة 5 من هذا القانون", "مادة 12 عقد", "المادة 99 من القانون المدني", "عقد البيع"])
+def test_unresolved_reference_falls_back_to_search(corpus, text):
+    assert lookup_reference(corpus, text) is None
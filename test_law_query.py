@@ -0,0 +1,63 @@
+"""اختبارات لغة الاستعلام المتقدمة والتظليل على مكتبة صغيرة في الذاكرة.
+
+التشغيل من مجلد المستودع: python -m pytest -q test_law_query.py
+"""
+import pytest
+
+from law_corpus import Article, Corpus, LawFile
+from law_highlight import extract_context_from_spans, merge_spans
+from law_query import QuerySyntaxError, parse_query, run_query
+
+ARTICLES = [
+    ["مادة (1)", "يتم عقد البيع بالإيجاب والقبول."],
+    ["مادة (2)", "البيع عقد يلتزم به البائع."],
+    ["مادة (3)", "للمشتري حق الفسخ إذا كان البيع معيبًا، ويجوز البيع بالتقسيط."],
+]
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    articles = tuple(Article("قانون الاختبار", str(i), paragraphs) for i, paragraphs in enumerate(ARTICLES, 1))
+    law_file = LawFile("laws", "laws/قانون الاختبار.docx", "قانون الاختبار", articles)
+    return Corpus("test", ["laws"], {}, [law_file], {})
+
+
+def article_text(article_id):
+    return "\n".join(ARTICLES[article_id])
+
+
+def test_merge_spans_joins_overlapping_and_adjacent():
+    assert merge_spans([(58, 63), (54, 63), (10, 12), (12, 15), (20, 21)]) == [(10, 15), (20, 21), (54, 63)]
+    assert merge_spans([]) == []
+
+
+def test_overlapping_query_spans_are_merged(corpus):
+    results = dict(run_query(corpus, parse_query('"عقد البيع" | البيع')))
+    text = article_text(0)
+    assert [text[s:e] for s, e in results[0]] == ["عقد البيع"]
+
+
+def test_overlapping_spans_give_well_formed_marks():
+    paragraphs = ["يتم عقد البيع بالإيجاب"]
+    _, html = extract_context_from_spans(paragraphs, [(4, 13), (8, 13)])
+    assert html == "يتم <mark>عقد البيع</mark> بالإيجاب"
+
+
+@pytest.mark.parametrize("query_text", ["-عقد", "NOT البيع", "-عقد -البيع", "عقد | -البيع"])
+def test_queries_without_positive_terms_are_rejected(query_text):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query_text)
+
+
+def test_excluded_terms_with_positive_term(corpus):
+    results = dict(run_query(corpus, parse_query("البيع -الفسخ")))
+    assert sorted(results) == [0, 1]
+    assert all(results.values())
+
+
+def test_near_needs_two_distinct_occurrences(corpus):
+    # "البيع" مرة واحدة في المادتين 1 و2، ومرتان على بعد 3 كلمات في المادة 3
+    results = dict(run_query(corpus, parse_query("البيع ~3 البيع")))
+    assert sorted(results) == [2]
+    assert len(results[2]) == 2
+    assert not run_query(corpus, parse_query("البيع ~2 البيع"))
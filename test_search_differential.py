@@ -0,0 +1,118 @@
+"""اختبار تفاضلي للبحث: نتائج iter_search_hits مقارنة بحلقة "يحتوي على" الأصلية على نفس المواد.
+
+الحلقة الأصلية تفحص any(kw.lower() in text.lower()) لكل مادة. البحث الحالي يطابق على النص
+الموحد (دون حركات وتطويل وبصور حروف موحدة)، فيجب أن تكون نتائجه:
+    - مطابقة تمامًا لنفس الحلقة على النصوص الموحدة، بفهرس FTS5 أو بفهرس الثلاثيات؛
+    - مطابقة للحلقة الأصلية في المواد التي لا يغيرها التوحيد، للكلمات التي لا يغيرها التوحيد؛
+    - شاملة لنتائج الحلقة الأصلية للكلمات المشكولة أو المطولة، ومساوية لنتائج الكلمة المجردة.
+
+التشغيل من مجلد المستودع: python -m pytest -q test_search_differential.py
+"""
+import os
+import threading
+
+import pytest
+
+import law_fts
+import law_search
+from arabic_text import normalize
+from law_corpus import refresh_corpus
+
+# كلمات لا يغيرها التوحيد: أطوال مختلفة (القصيرة تُفحص دون فهرس) وكلمات متعددة
+NEUTRAL_QUERIES = ["عقد", "البيع", "المحكمه", "ضرر", "البيع, عقد", "من", "في", "ر, عقد"]
+# نفس الكلمة بحركات أو تطويل أو صور حروف مختلفة، مع الكلمة المجردة المكافئة
+VARIANT_QUERIES = [("عَقْد", "عقد"), ("عـقد", "عقد"), ("البَيْـع", "البيع"), ("المحكمة", "المحكمه")]
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    # مسارات مجلدات القوانين نسبية إلى مجلد التشغيل كما في التطبيق
+    cwd = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        corpus = refresh_corpus(".")[0]
+        if not corpus.article_count():
+            pytest.skip("لا توجد ملفات قوانين للاختبار")
+        law_search.prepare_indexes(corpus)
+        yield corpus
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(params=["fts", "trigram"])
+def index_kind(request, monkeypatch):
+    """تشغيل كل اختبار مرة بفهرس FTS5 ومرة بفهرس الثلاثيات في الذاكرة."""
+    if request.param == "trigram":
+        monkeypatch.setattr(law_fts, "search_index", lambda corpus, keywords, paths=None: None)
+    return request.param
+
+
+def article_texts(corpus):
+    return ["\n".join(article.paragraphs) for _, article in corpus.entries()]
+
+
+def baseline_ids(texts, keywords):
+    """حلقة البحث الأصلية قبل الفهارس."""
+    return {i for i, text in enumerate(texts) if any(kw.lower() in text.lower() for kw in keywords)}
+
+
+def search_ids(corpus, query_text):
+    return {hit[0] for _, hits in law_search.iter_search_hits(corpus, query_text) for hit in hits}
+
+
+@pytest.mark.parametrize("query_text", NEUTRAL_QUERIES)
+def test_matches_substring_loop_on_normalized_text(corpus, index_kind, query_text):
+    keywords = law_search.parse_keywords(query_text)
+    normalized_texts = [normalize(text) for text in article_texts(corpus)]
+    assert search_ids(corpus, query_text) == baseline_ids(normalized_texts, [normalize(kw) for kw in keywords])
+
+
+@pytest.mark.parametrize("query_text", NEUTRAL_QUERIES)
+def test_matches_original_loop_for_neutral_queries(corpus, index_kind, query_text):
+    keywords = law_search.parse_keywords(query_text)
+    assert all(normalize(kw) == kw.lower() for kw in keywords)
+    texts = article_texts(corpus)
+    expected = baseline_ids(texts, keywords)
+    found = search_ids(corpus, query_text)
+    assert expected <= found
+    # المواد الزائدة فقط تلك التي يغيرها التوحيد (حركات أو تطويل أو صور حروف داخل الكلمة)
+    assert all(normalize(texts[i]) != texts[i].lower() for i in found - expected)
+
+
+@pytest.mark.parametrize("query_text, bare", VARIANT_QUERIES)
+def test_diacritics_and_tatweel_give_superset(corpus, index_kind, query_text, bare):
+    found = search_ids(corpus, query_text)
+    assert baseline_ids(article_texts(corpus), [query_text]) <= found
+    assert found == search_ids(corpus, bare)
+
+
+@pytest.mark.parametrize("query_text", ["عقد", "البَيْـع, ضرر"])
+def test_spans_point_at_matches_in_original_text(corpus, query_text):
+    keywords = [normalize(kw) for kw in law_search.parse_keywords(query_text)]
+    texts = article_texts(corpus)
+    for _, hits in law_search.iter_search_hits(corpus, query_text):
+        for article_id, spans, _ in hits:
+            assert spans
+            for start, end in spans:
+                assert any(kw in normalize(texts[article_id][start:end]) for kw in keywords)
+
+
+def test_results_are_merged_in_query_rank_order(corpus):
+    # كل قانون يُبحث فيه على حدة، ودرجات bm25 المدمجة تطابق ترتيب استعلام واحد على النطاق كله
+    hits = [hit for _, law_hits in law_search.iter_search_hits(corpus, "البيع, عقد") for hit in law_hits]
+    whole_scope = law_fts.search_index(corpus, ["البيع", "عقد"])
+    assert [rank for _, _, rank in sorted(hits, key=lambda hit: hit[2])] == [score for _, _, score in whole_scope]
+    assert {hit[0] for hit in hits} == set(law_search.search_articles(corpus, ["البيع", "عقد"]))
+
+
+def test_laws_stream_before_search_finishes(corpus, index_kind):
+    """الإلغاء بعد أول قانون يوقف البحث قبل حساب بقية القوانين."""
+    if len(corpus.law_files) < 2:
+        pytest.skip("يلزم قانونان على الأقل")
+    for query_text in ("عقد", "بيع ~3 عقد"):
+        cancel_event = threading.Event()
+        produced = []
+        for law_file, _ in law_search.iter_search_hits(corpus, query_text, cancel_event=cancel_event):
+            produced.append(law_file)
+            cancel_event.set()
+        assert len(produced) == 1